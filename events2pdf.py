@@ -9,25 +9,127 @@ See ./docs/Installation
         ./docs/README-Reportlab
 """
 
-from reportlab.lib.pagesizes import legal, letter, landscape, portrait
-from reportlab.platypus import BaseDocTemplate, Frame, Paragraph,\
-    Table, TableStyle, PageTemplate, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER, TA_RIGHT
-from reportlab.lib.units import inch
-
-import  os, sys, json, re
+"""
+Imports:  reportlab, requests, filetype and pypdf are imported in the
+functions that use them so -h, config errors, gui startup and runs that
+don't need them don't pay for them, see startup in events2pdf_bench.py.
+"""
 
-try:
-    import pyphen
-except Exception as err:
-   print(f"events2pdf: warning: hypenation will not work: {err}", file=sys.stderr)
+import  os, sys, json, re, functools
 
 CONFIG_FILE = "events2pdf_conf.json"
 
+@functools.lru_cache(maxsize=None)
+def get_styles():
+    """Sample style sheet, built once."""
+
+    from reportlab.lib.styles import getSampleStyleSheet
+    from importlib.util import find_spec
+
+    if find_spec('pyphen') is None:       # reportlab hyphenates with pyphen
+       print("events2pdf: warning: hypenation will not work: no module named pyphen", file=sys.stderr)
+    return(getSampleStyleSheet())
+
 import logging
 logger = logging.getLogger(__name__)
-logging.basicConfig(filename='events2pdf.log',  filemode='w', level=logging.DEBUG)
+
+def setup_logging():
+    """Log to events2pdf.log, overwritten by each run."""
+
+    logging.basicConfig(filename='events2pdf.log',  filemode='w', level=logging.DEBUG)
+
+class Hyphenator:
+    """Memoized pyphen hyphenation, the hyphenationLang of the styles.
+
+    reportlab calls it with a word and gets the (head, tail) splits, the
+    longest head first.  Words are looked up in the exceptions file, then
+    in the words hyphenated before, saved in the store file between runs.
+    pyphen is loaded on the first word found in neither.
+
+    The exceptions file has words with a hyphen where they may be split,
+    Mic-a-no-py, a word without hyphens is never split.
+    """
+
+    def __init__(self, lang, exceptions='', store=''):
+        self.lang, self.exceptions_file, self.store = lang, exceptions, store
+        self.exceptions, self.words = {}, {}
+        self.pyphen = None
+        self.calls = self.lookups = 0
+        self.mtime = os.path.getmtime(exceptions) if exceptions and os.path.exists(exceptions) else 0
+        try:
+            if self.mtime:
+                with open(exceptions) as f:
+                    for word in f.read().split():
+                        if not word.startswith('#'):
+                            self.exceptions[word.replace('-', '').lower()] = \
+                                [i - n for n, i in enumerate(i for i, c in enumerate(word) if c == '-')]
+            if store and os.path.exists(store):
+                with open(store) as f:
+                    self.words = json.load(f)
+        except Exception as err:
+            logger.error(f"Hyphenator: {err}")
+        self.saved_words = len(self.words)
+
+    def __repr__(self):         # part of the style, see style_fingerprint in events2pdf_measure.py
+        return(f"Hyphenator({self.lang!r}, {self.exceptions_file!r}, {self.mtime})")
+
+    def __reduce__(self):       # worker processes load their own
+        return(get_hyphenator, (self.lang, self.exceptions_file, self.mtime, self.store))
+
+    def positions(self, word):
+        if self.pyphen is None:
+            import pyphen
+            self.pyphen = pyphen.Pyphen(lang=self.lang)
+        self.lookups += 1
+        return([int(i) for i in self.pyphen.positions(word)])
+
+    def __call__(self, word):
+        self.calls += 1
+        key = word.lower()
+        positions = self.exceptions.get(key)
+        if positions is None:
+            positions = self.words.get(key)
+            if positions is None:
+                positions = self.words[key] = self.positions(key)
+        return([(word[:i], word[i:]) for i in reversed(positions)])
+
+    def save(self):
+        """Log the calls saved, write new words to the store."""
+
+        logger.debug(f"Hyphenator: {self.calls} words, {self.lookups} hyphenated by pyphen,"
+            f" {self.calls - self.lookups} calls saved")
+        if self.store and len(self.words) > self.saved_words:
+            try:
+                os.makedirs(os.path.dirname(self.store), exist_ok=True)
+                tmp = temp_file(self.store)     # renders in other threads save too
+                with open(tmp, "w") as f:
+                    json.dump(dict(self.words), f)
+                os.replace(tmp, self.store)
+                self.saved_words = len(self.words)
+            except Exception as err:
+                logger.error(f"Hyphenator: can't save {self.store}: {err}")
+        self.calls = self.lookups = 0
+
+@functools.lru_cache(maxsize=None)
+def get_hyphenator(lang, exceptions, mtime, store):
+    """One Hyphenator per settings, mtime reloads a changed exceptions file."""
+
+    return(Hyphenator(lang, exceptions, store))
+
+def hyphenation(conf):
+    """hyphenationLang for the styles, a Hyphenator, or '' without pyphen."""
+
+    lang = conf.get('mhyphenation', 'en')
+    get_styles()                    # warns if pyphen is missing
+    from importlib.util import find_spec
+    if not lang or find_spec('pyphen') is None:
+        return('')
+    exceptions = conf.get('mhyphen_exceptions', '')
+    mtime = os.path.getmtime(exceptions) if exceptions and os.path.exists(exceptions) else 0
+    store = ''
+    if conf.get('mhyphen_cache', True):
+        store = os.path.abspath(os.path.join(conf.get('mcache_dir', CACHE_DIR), f"hyphen_{lang}.json"))
+    return(get_hyphenator(lang, exceptions, mtime, store))
 
 def usage():
     print(f"usage: defaults will be used for missing arguments\n",
@@ -35,37 +137,468 @@ def usage():
               f"[-i] url | input_file | -, - means stdin\n",
               f"[-o] output_file | -, - means stdout\n",
               f"[-c] use this config file\n",
+              f"[-e] editions file, create a pdf for each edition\n",
+              f"[-q] query, json dict of event key: values, ex, '{{\"region\": \"Alachua\", \"types\": [\"O\"]}}'\n",
               f"[-f] fontname, ex, 'Helvetica'\n",
               f"[-s] font_size in points\n",
+              f"[-t] pages, fit font size, leading and frames to this many pages\n",
               f"[-p] page orientation: portrait, default is landscape\n",
-              f"[-l] page size: letter, default is legal",
+              f"[-l] page size: letter, default is legal\n",
+              f"[--force] build the pdf even if events and config are unchanged\n",
+              f"[--profile] dump cProfile stats and tracemalloc snapshots of the slow stages to {PROFILE_DIR}\n",
+              f"[--watch] keep running, build the pdf again whenever the config, cover page or events change",
               file=sys.stderr)
 
 
-import io
-import requests
+import io, codecs, mmap, hashlib, time, threading
+
+# event keys used by the formatters and merge_events(), everything else is dropped at load time
+EVENT_FIELDS = ('day', 'time', 'time_formatted', 'name', 'types', 'location',
+    'formatted_address', 'region', 'notes', 'attendance_option', 'id', 'slug', 'updated')
+
+CHUNK_SIZE = 64 * 1024
+FEED_TIMEOUT = 30           # seconds, default mfeed_timeout
 
-def load_events(arg):
-    """Get events from stdin, url or file"""
+HEADERS = {
+     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.12; rv:55.0) Gecko/20100101 Firefox/55.0',
+}
 
-    headers = {
-         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.12; rv:55.0) Gecko/20100101 Firefox/55.0',
-    }
+_JSON_SKIP = re.compile(r'[\s,]*')
+
+_TYPE_SETS = {}
+
+def _intern(v):
+    return(sys.intern(v) if isinstance(v, str) else v)
+
+class Event:
+    """One event, the EVENT_FIELDS of a feed dict, made at load time.
+
+    Strings many events share, region, location, address, times, are
+    interned and types is a frozenset shared by events of the same types.
+    A missing field is None.  get(), [] and in work like on the feed dict,
+    also for fields kept in extra for msection_key and msort_keys.
+    """
+
+    __slots__ = EVENT_FIELDS + ('extra',)
+
+    def __init__(self, d, extra=()):
+        get = d.get
+        self.day, self.name, self.notes = get('day'), get('name'), get('notes')
+        self.id, self.slug, self.updated = get('id'), get('slug'), get('updated')
+        self.time, self.time_formatted = _intern(get('time')), _intern(get('time_formatted'))
+        self.location, self.formatted_address = _intern(get('location')), _intern(get('formatted_address'))
+        self.region, self.attendance_option = _intern(get('region')), _intern(get('attendance_option'))
+        types = get('types')
+        if types is not None:
+            types = frozenset(types)
+            types = _TYPE_SETS.setdefault(types, types)
+        self.types = types
+        self.extra = {k: d[k] for k in extra if k in d} or None
+
+    def get(self, key, default=None):
+        if key in EVENT_FIELDS:
+            v = getattr(self, key)
+        else:
+            v = self.extra.get(key) if self.extra else None
+        return(default if v is None else v)
+
+    def __getitem__(self, key):
+        v = self.get(key)
+        if v is None:
+            raise KeyError(key)
+        return(v)
+
+    def __contains__(self, key):
+        return(self.get(key) is not None)
+
+    def to_dict(self):
+        d = {k: getattr(self, k) for k in EVENT_FIELDS if getattr(self, k) is not None}
+        if self.types is not None:
+            d['types'] = sorted(self.types)
+        d.update(self.extra or {})
+        return(d)
+
+    def __repr__(self):
+        return(f"Event({self.to_dict()})")
+
+def extra_fields(conf):
+    """Event keys named by msection_key or msort_keys that aren't EVENT_FIELDS."""
+
+    if not conf:
+        return(())
+    keys = [conf.get('msection_key', 'day')] + conf.get('msort_keys', [])
+    return(tuple(k for k in keys if k not in EVENT_FIELDS))
+
+def iter_json_list(chunks):
+    """Decode a json list of dicts from byte chunks, yield one dict at a time.
+
+    Only the current chunk and the event being decoded are held in memory,
+    the full document is never read into one string.
+    """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        pos = _JSON_SKIP.match(buf, pos).end()
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError(f"expected a json list of events, got {buf[pos:pos+20]!r}")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                event, pos = decoder.raw_decode(buf, pos)
+                yield event
+                continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        elif eof:
+            raise ValueError("unexpected end of events list")
+
+        chunk = next(chunks, None)          # need more input
+        if chunk is None:
+            eof = True
+            buf = buf[pos:] + utf8.decode(b'', final=True)
+        else:
+            buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+
+def file_chunks(path):
+    """Yield chunks of a memory mapped file."""
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:     # can't mmap an empty file
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(0, len(mm), CHUNK_SIZE):
+                yield mm[i:i+CHUNK_SIZE]
+
+def iter_events(arg, conf=None, extra=()):
+    """Stream events from stdin, url or file, yield Events."""
+
+    if arg == '-':
+        chunks = iter(lambda: sys.stdin.buffer.read(CHUNK_SIZE), b'')
+    elif arg.find('http') >= 0:
+        from events2pdf_http import get, iter_body
+        chunks = iter_body(get(arg, conf or {}, HEADERS), conf or {}, CHUNK_SIZE)
+    else:               # assume file
+        chunks = file_chunks(arg)
+
+    for e in iter_json_list(chunks):
+        yield Event(e, extra)
+
+CACHE_DIR = ".events2pdf_cache"
+
+def cache_path(conf, kind, key, ext):
+    """Path of a cache file, cache files are named by a hash of their key."""
+
+    d = os.path.join(conf.get('mcache_dir', CACHE_DIR), kind)
+    os.makedirs(d, exist_ok=True)
+    return(os.path.join(d, hashlib.sha256(key.encode()).hexdigest()[:32] + ext))
+
+def temp_file(path):
+    """Temp file next to path for this process and thread, os.replace() it
+    onto path when complete.
+
+    Each writer has its own, so server threads, editions and workers
+    writing the same file don't collide.
+    """
+
+    return(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+def fetch_feed(url, conf):
+    """Download url to the feed cache with a conditional get, return the cached file.
+
+    The ETag and Last-Modified headers of the last good download are sent
+    back as If-None-Match and If-Modified-Since, a 304 reuses the cached
+    body.  A copy younger than mfeed_max_age seconds is used without asking
+    the server, the last good copy is used if the server can't be reached.
+    """
+
+    body = cache_path(conf, 'feeds', url, '.json')
+    meta_file = cache_path(conf, 'feeds', url, '.meta')
+
+    meta = {}
+    if os.path.exists(body):
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+        except Exception as err:
+            logger.debug(f"fetch_feed: ignoring feed cache for {url}: {err}")
+
+    if meta and time.time() - meta['fetched'] < conf.get('mfeed_max_age', 0):
+        logger.debug(f"fetch_feed: using cached feed for {url}, fetched {time.ctime(meta['fetched'])}")
+        return(body)
+
+    headers = dict(HEADERS)
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
 
     try:
-        if arg == '-':
+        from events2pdf_http import get, iter_body, log_timing
+        r = get(url, conf, headers)
+        if r.status_code == 304 and meta:
+            log_timing(r, 0)
+            logger.debug(f"fetch_feed: {url} not modified, using cached feed")
+        else:
+            r.raise_for_status()
+            tmp = temp_file(body)       # threads may download the same url
+            try:
+                with open(tmp, "wb") as f:
+                    for chunk in iter_body(r, conf, CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(tmp, body)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            meta = {
+                'url': url,
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+            }
+            logger.debug(f"fetch_feed: downloaded {url}, {os.path.getsize(body)} bytes")
+    except Exception as err:
+        if not meta:
+            raise
+        logger.error(f"fetch_feed: can't download {url}, using cached feed from {time.ctime(meta['fetched'])}: {err}")
+        return(body)
+
+    meta['fetched'] = time.time()
+    tmp = temp_file(meta_file)
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_file)
+    return(body)
+
+def load_events(arg, stream=False, conf=None):
+    """Get events from stdin, url or file, a list of Events."""
+
+    extra = extra_fields(conf)
+    try:
+        if conf and conf.get('mfeed_cache', False) and arg.find('http') >= 0:
+            arg = fetch_feed(arg, conf)         # load the cached copy as a file
+
+        if stream:
+            events = list(iter_events(arg, conf, extra))
+        elif arg == '-':
             stdin_wrapper = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig')
             events = json.load(stdin_wrapper)
         elif arg.find('http') >= 0:
-            events =  json.loads(requests.get(arg, headers=headers).text)
+            from events2pdf_http import get, iter_body
+            events = json.loads(b''.join(iter_body(get(arg, conf or {}, HEADERS), conf or {}, CHUNK_SIZE)))
         else:               # assume file
             with open(arg, "r") as f:
                 events = (json.load(f))
+        if not stream:
+            events = [Event(e, extra) for e in events]
     except Exception as err:
         logger.error( f"load_events: fatal error loading events from {arg}: {err}")
         return([])
     return(events)
 
+def event_key(e):
+    return(e.get('slug') or e.get('id'))
+
+def merge_events(feeds):
+    """One list of the events of several feeds.
+
+    An event in more than one feed, same slug or, without a slug, same id,
+    is kept once; the one updated last wins.
+    """
+
+    merged, unkeyed = {}, []
+    for events in feeds:
+        for e in events:
+            key = event_key(e)
+            if key is None:
+                unkeyed.append(e)
+                continue
+            old = merged.get(key)
+            if old is None or str(e.get('updated', '')) > str(old.get('updated', '')):
+                merged[key] = e
+    logger.debug(f"merge_events: {sum(len(x) for x in feeds)} events, {len(merged) + len(unkeyed)} after merging")
+    return(list(merged.values()) + unkeyed)
+
+def load_sources(conf, sources):
+    """Load a list of minput sources at the same time and merge them.
+
+    Each source gets mfeed_timeout seconds; one that fails or is late is
+    left out, the others don't wait for it.  Sources load in daemon
+    threads, a late one doesn't keep the process running once the pdf
+    is done.
+    """
+
+    timeout = conf.get('mfeed_timeout', FEED_TIMEOUT)
+    results = [None] * len(sources)
+    def load(i, source):
+        try:
+            results[i] = load_events(source, conf.get('mstream_input', False), conf)
+        except Exception as err:
+            logger.error(f"load_sources: can't load {source}: {err}")
+            results[i] = []
+
+    threads = [threading.Thread(target=load, args=(i, s), daemon=True) for i, s in enumerate(sources)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0, deadline - time.monotonic()))
+
+    feeds = []
+    for source, t, events in zip(sources, threads, results):
+        if t.is_alive():
+            logger.error(f"load_sources: {source} took more than {timeout}s, left out")
+        elif len(events) == 0:
+            logger.error(f"load_sources: no events from {source}, left out")
+        else:
+            logger.debug(f"load_sources: {len(events)} events from {source}")
+            feeds.append(events)
+    return(merge_events(feeds))
+
+def sources(conf):
+    """minput as a list."""
+
+    return(conf['minput'] if isinstance(conf['minput'], list) else [conf['minput']])
+
+
+import contextlib
+
+PROFILE_DIR = "events2pdf_profile"
+HOT_STAGES = ('load_events', 'format', 'build')
+
+def max_rss_mb():
+    """Peak resident memory of the process so far, None on windows."""
+
+    try:
+        import resource
+    except ImportError:
+        return(None)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return(round(rss / (2**20 if sys.platform == 'darwin' else 2**10), 1))
+
+class Cancelled(BaseException):
+    """Raised at the next stage or page of a run that was cancelled.
+
+    Not an Exception, so the error handling of each stage doesn't catch it.
+    """
+
+class Metrics:
+    """Wall time, cpu time, memory and counts of the stages of one run.
+
+    A stage run more than once, for each edition for example, adds up.
+    Peak allocations are traced with --profile only, tracemalloc slows the
+    run down; the hot stages then also dump cProfile stats and a
+    tracemalloc snapshot to PROFILE_DIR.
+
+    progress(stage, value) is called as each stage starts and with
+    ('layout', page) for each page laid out.  Setting the cancel event
+    stops the run with Cancelled at the next of these.
+    """
+
+    def __init__(self, profile=False, progress=None, cancel=None):
+        self.profile = profile
+        self.progress, self.cancel = progress, cancel
+        self.started = time.perf_counter()
+        self.record = {'date': datetime.now().isoformat(timespec='seconds'), 'stages': {}}
+
+    def report(self, stage, value=None):
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled(f"cancelled at {stage}")
+        if self.progress:
+            self.progress(stage, value)
+
+    def layout_progress(self, kind, value):
+        """reportlab progress callback."""
+
+        if kind == 'PAGE':
+            self.report('layout', value)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.report(name)
+        s = self.record['stages'].setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+        s['calls'] += 1
+        profiler = None
+        if self.profile:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):      # python 3.9, before it the peak since start
+                tracemalloc.reset_peak()
+            if name in HOT_STAGES:
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            s['wall'] += time.perf_counter() - wall
+            s['cpu'] += time.process_time() - cpu
+            if profiler:
+                profiler.disable()
+            if self.profile:
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                s['peak_alloc_mb'] = round(max(s.get('peak_alloc_mb', 0), peak), 2)
+                if profiler:
+                    self.dump(f"{name}_{s['calls']}", profiler, tracemalloc.take_snapshot())
+            s['max_rss_mb'] = max_rss_mb()
+
+    def dump(self, name, profiler, snapshot):
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+            snapshot.dump(os.path.join(PROFILE_DIR, f"{name}.tracemalloc"))
+        except Exception as err:
+            logger.error(f"Metrics: can't dump profile {name}: {err}")
+
+    def count(self, **counts):
+        for k, v in counts.items():
+            self.record[k] = self.record.get(k, 0) + v
+
+    def emit(self, conf):
+        """Log the record as one json line, append it to mmetrics_file."""
+
+        self.record['wall'] = round(time.perf_counter() - self.started, 4)
+        for s in self.record['stages'].values():
+            s['wall'], s['cpu'] = round(s['wall'], 4), round(s['cpu'], 4)
+        line = json.dumps(self.record)
+        logger.info(f"metrics: {line}")
+        path = (conf or {}).get('mmetrics_file', '')
+        if path:
+            try:
+                with open(path, "a") as f:
+                    f.write(line + "\n")
+            except Exception as err:
+                logger.error(f"Metrics: can't write {path}: {err}")
+
+_run = threading.local()            # server threads each run their own
+
+def start_metrics(profile=False, progress=None, cancel=None):
+    """Start the metrics of a new run in this thread."""
+
+    _run.metrics = Metrics(profile, progress, cancel)
+    return(_run.metrics)
+
+def metrics():
+    """Metrics of the current run."""
+
+    if getattr(_run, 'metrics', None) is None:
+        start_metrics()
+    return(_run.metrics)
+
 
 import getopt
 
@@ -77,7 +610,7 @@ def get_config():
 
     if len(sys.argv) > 1:
         try:
-            opts, args = getopt.getopt(sys.argv[1:],"i:o:c:f:b:s:dhlp")
+            opts, args = getopt.getopt(sys.argv[1:],"i:o:c:e:q:f:b:s:t:dhlp", ["force", "profile", "watch"])
             for opt, arg in opts:
                 logger.debug(f"get_config: opt = {opt}, arg={arg}")
         except Exception as err:
@@ -86,18 +619,28 @@ def get_config():
             return([])
 
         for opt, arg in opts:
-            if opt in ['-i']:
-                c['minput'] = arg
+            if opt in ['-i']:         # given more than once, a list of sources
+                c['minput'] = sources(c) + [arg] if 'minput' in c else arg
             elif opt in ['-o']:
                 c['moutput']  = arg
             elif opt in ['-c']:
                 config_file = arg
+            elif opt in ['-e']:
+                c['meditions'] = arg
+            elif opt in ['-q']:
+                try:
+                    c['mquery'] = json.loads(arg)
+                except Exception as err:
+                    print(f"invalid query: {arg} {err}", file=sys.stderr)
+                    return([])
             elif opt in ['-f']:
                 c['mfont'] = arg
             elif opt in ['-b']:
                c['mfont'] = arg
             elif opt in ['-s']:
                c['mfont_size'] = float(arg)
+            elif opt in ['-t']:
+               c['mtarget_pages'] = int(arg)
             elif opt in ['-h']:
                 usage()
                 return([])
@@ -105,6 +648,12 @@ def get_config():
                 c['mpage_size'] = 'letter'
             elif opt in   ['-l']:
                 c['mpage_orientation'] = 'portrait'
+            elif opt in ['--force']:
+                c['mforce'] = True
+            elif opt in ['--profile']:
+                c['mprofile'] = True
+            elif opt in ['--watch']:
+                c['mwatch'] = True
 
     try:
         conf = json.load(open(config_file))
@@ -116,47 +665,110 @@ def get_config():
     for k in c:			# override defaults or config file with any command line args
         conf[k] = c[k]
 
+    conf['mconfig_file'] = config_file          # watched by --watch
     return(conf)
 
 
-import filetype
-
-def is_image(f):
-    """test if file is image"""
+COVER_DPI = 200
 
-    ft = filetype.guess(f)
-    if ft and ft.mime.find('image') >= 0:
-        return(True)
-    return(False)
+def cover_asset(conf, path, width):
+    """Cover page file as (image file, mime type, aspect ratio) for a frame width.
 
+    Images are resized to mcover_dpi at the printed width.  Results are
+    kept in the cover cache by path, mtime, size, width and dpi so later
+    builds don't sniff or decode the file.  The image file is None if the
+    cover page isn't an image.
+    """
 
-from reportlab.lib import utils
+    st = os.stat(path)
+    args = (os.path.abspath(path), st.st_mtime, st.st_size, round(width, 2),
+        conf.get('mcover_dpi', COVER_DPI), conf.get('mcache_dir', CACHE_DIR))
+    asset = cached_cover_asset(*args)
+    if asset[0] is not None and not os.path.exists(asset[0]):     # mcache_dir was deleted
+        cached_cover_asset.cache_clear()
+        asset = cached_cover_asset(*args)
+    return(asset)
+
+@functools.lru_cache(maxsize=16)
+def cached_cover_asset(path, mtime, size, width, dpi, cache_dir):
+    conf = {'mcache_dir': cache_dir}
+    key = json.dumps([path, mtime, size, width, dpi])
+    meta_file = cache_path(conf, 'cover', key, '.meta')
 
-def get_image(path, width):
-    """Resize cover page image to fit frame."""
+    try:
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        if meta['file'] is None or os.path.exists(meta['file']):
+            return(meta['file'], meta['mime'], meta['aspect'])
+    except Exception:
+        pass                            # not cached yet
+
+    import filetype
+
+    ft = filetype.guess(path)
+    meta = {'file': None, 'mime': ft.mime if ft else None, 'aspect': None}
+    if meta['mime'] and meta['mime'].find('image') >= 0:
+        from PIL import Image as PILImage
+
+        with PILImage.open(path) as img:
+            iw, ih = img.size
+            meta['aspect'] = ih / float(iw)
+            pixels = round(width / 72 * dpi)        # width is in points
+            if iw <= pixels:                        # already small enough
+                meta['file'] = path
+            else:
+                img = img.resize((pixels, max(1, round(pixels * meta['aspect']))), PILImage.LANCZOS)
+                if meta['mime'] == 'image/jpeg':
+                    meta['file'] = cache_path(conf, 'cover', key, '.jpg')
+                    tmp = temp_file(meta['file'])
+                    img.save(tmp, 'JPEG', quality=90)
+                else:
+                    meta['file'] = cache_path(conf, 'cover', key, '.png')
+                    tmp = temp_file(meta['file'])
+                    img.save(tmp, 'PNG')
+                os.replace(tmp, meta['file'])
+                if os.path.getsize(meta['file']) >= size:     # resampling can make it bigger
+                    os.remove(meta['file'])
+                    meta['file'] = path
+                logger.debug(f"cover_asset: resized {path} from {iw}x{ih} to {img.size[0]}x{img.size[1]}"
+                    f" for {dpi} dpi, {'kept original' if meta['file'] == path else 'using resized'}")
+
+    tmp = temp_file(meta_file)
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_file)
+    return(meta['file'], meta['mime'], meta['aspect'])
+
+def get_image(path, width, aspect):
+    """Cover page image sized to fit frame."""
+
+    from reportlab.platypus import Image
 
     try:
-        img = utils.ImageReader(path)
-        iw, ih = img.getSize()
-        aspect = ih / float(iw)
         return(Image(path, width=width, height=(width * aspect)))
     except Exception as err:
         logger.error(f"get_image: failed: {err}")
         return(None)
 
+DEFAULT_COVER_PAGE = "<b>Meeting Schedule</b>"
+
 
 from datetime import datetime
 
 def get_cover_page(conf, width):
     """Prepares cover page from image, text file or default in this script."""
 
-    styles = getSampleStyleSheet()
+    from reportlab.platypus import Paragraph
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER
+
+    styles = get_styles()
     styleCP = ParagraphStyle('cover_page',
                fontName = conf['mfont'],
                fontSize=conf['mfont_size'],
                parent=styles['Normal'],
                leading=conf['mfont_size']*1.2,
-               hyphenationLang = 'en',
+               hyphenationLang = hyphenation(conf),
                alignment= TA_CENTER)
 
     cp = []
@@ -164,10 +776,17 @@ def get_cover_page(conf, width):
     cp.append(Paragraph(f"<b>{t_date}</b>",  styleCP))
 
     if os.path.exists(conf['mcover_page']):
-        if is_image(conf['mcover_page']):         # resize to fit frame
-            img = get_image(conf['mcover_page'], width)
+        try:
+            image, mime, aspect = cover_asset(conf, conf['mcover_page'], width)
+        except Exception as err:
+            logger.error(f"get_cover_page: can't read cover page image: {conf['mcover_page']}: {err}")
+            return(cp)
+        if image:         # resized to fit frame
+            img = get_image(image, width, aspect)
             if img:                             # just skip if get_image fails
                 cp.append(img)
+        elif mime:
+            logger.error(f"get_cover_page: cover page is {mime}, not an image or text: {conf['mcover_page']}")
         else:
             try:
                 with open(conf['mcover_page'], "r") as f:
@@ -182,111 +801,414 @@ def get_cover_page(conf, width):
 
 r"""
 functions to format table cells
-format_group() re explanation:
+strip_address() re explanation:
   capture address up to region name, strip trailing comma or space
-  re.match(r"(.*)\s"+m['region'], m['formatted_address'])[1].rstrip(', ')
+  re.match(r"(.*)\s"+re.escape(m['region']), m['formatted_address'])[1].rstrip(', ')
   formatted_address = '17405 US-441, High Springs, FL 32643, USA'
   region = 'High Springs'
   captured address = '17405 US-441'
+the caches are cleared by get_events() for each run, many meetings share
+a venue and types so most cells reuse earlier results
 """
 
+DESIGNATIONS_MAP = {
+    'O': 'O',
+    'C': 'C',
+    'D': 'D',
+    'MED': 'M',
+    'SP': 'S',
+    'B': 'BB',
+    'LIT': 'LIT',
+    'ST': 'SS',
+    'BE': 'BG',
+    'CF': 'CF',
+    'X': 'WC',
+}
+
+_NON_BREAKING = re.compile('[ -]')
+
+# the formatters return a cell as a list of (kind, text) parts: text, bold
+# text, text that doesn't break at spaces and hyphens, a hard line break.
+# Text may hold reportlab markup, notes from the feed do.
+TEXT, BOLD, NOBREAK, BREAK = 'text', 'bold', 'nobreak', 'break'
+BR = (BREAK, '')
+
+def markup(parts):
+    """Paragraph markup of a cell's parts."""
+
+    out = []
+    for kind, text in parts:
+        if kind == BOLD:
+            out.append(f"<b>{text}</b>")
+        elif kind == BREAK:
+            out.append("<br/>")
+        elif kind == NOBREAK:
+            out.append(_NON_BREAKING.sub('&nbsp;', text))
+        else:
+            out.append(f"{text}")
+    return(''.join(out))
+
+_UNCLEAN = re.compile(r'^\s|\s$|\s\s|[^\S ]')      # whitespace reportlab cleans up
+_MARKUP_CHARS = re.compile('[<>&]')
+_NBSP = re.compile('(\xa0)')
+
+def frag_templates(style):
+    """Paragraph frags of style for bold and plain text and a line break, by part kind."""
+
+    from reportlab.platypus import Paragraph
+
+    bold, br, text = Paragraph("<b>x</b><br/>x", style).frags
+    return({BOLD: bold, BREAK: br, TEXT: text})
+
+def cell_frags(parts, text, templates):
+    """The frags reportlab's parser makes of text, the markup of parts, without parsing it.
+
+    None if a part holds markup or text has whitespace the parser cleans,
+    the cell is parsed then.  Like the parser each &nbsp; is a frag of its
+    own and text between tags is 1 frag.
+    """
+
+    if _UNCLEAN.search(text):
+        return(None)
+    pieces = []         # [kind, text]
+    for kind, s in parts:
+        if kind == BREAK:
+            pieces.append([BREAK, ''])
+            continue
+        if not isinstance(s, str) or not s or _MARKUP_CHARS.search(s):
+            return(None)
+        if kind == NOBREAK:
+            kind, s = TEXT, _NON_BREAKING.sub('\xa0', s)
+        for word in _NBSP.split(s):
+            if not word:
+                continue
+            if word != '\xa0' and pieces and pieces[-1][0] == kind and pieces[-1][1] != '\xa0':
+                pieces[-1][1] += word
+            else:
+                pieces.append([kind, word])
+    return([new_frag(templates[kind], s) for kind, s in pieces])
+
+def new_frag(template, text):
+    """Copy of template frag with text, made like copy.copy() does but quicker.
+
+    ABag.clone() would build a dict 2.5 times as large, for every frag.
+    """
+
+    f = template.__class__.__new__(template.__class__)
+    f.__dict__.update(template.__dict__)
+    f.text = text
+    return(f)
+
+@functools.lru_cache(maxsize=None)
+def designations(types):
+    """Designations for a set of event types, ex. 'C/SS/WC'."""
+
+    return('/'.join(value for key, value in DESIGNATIONS_MAP.items() if key in types))
+
+@functools.lru_cache(maxsize=None)
+def region_pattern(region):
+    return(re.compile(r"(.*)\s" + re.escape(region)))
+
+@functools.lru_cache(maxsize=None)
+def strip_address(formatted_address, region):
+    """Street address up to the region name."""
+
+    m = region_pattern(region).match(formatted_address)
+    return(m[1].rstrip(', ') if m else formatted_address)      # no region, keep it all
+
+FORMATTER_CACHES = (designations, region_pattern, strip_address)
+
+def clear_formatter_caches():
+    for c in FORMATTER_CACHES:
+        c.cache_clear()
+
+def log_formatter_caches():
+    for c in FORMATTER_CACHES:
+        ci = c.cache_info()
+        calls = ci.hits + ci.misses
+        logger.debug(f"formatter cache {c.__name__}: {ci.hits}/{calls} hits"
+            f" ({100 * ci.hits / calls if calls else 0:.0f}%), {ci.currsize} entries")
+
 def format_time(m):
-    return(m['time_formatted'])
+    return([(TEXT, m.time_formatted)])
 
 def group_name(m):
     """Format group name and designations."""
 
-    if 'types' not in m:
-        return m['name']
-
-    designations_map = {
-        'O': 'O',
-        'C': 'C',
-        'D': 'D',
-        'MED': 'M',
-        'SP': 'S',
-        'B': 'BB',
-        'LIT': 'LIT',
-        'ST': 'SS',
-        'BE': 'BG',
-        'CF': 'CF',
-        'X': 'WC',
-    }
-
-    designations = []
-    for key, value in designations_map.items():
-        if key in m['types']:
-            designations.append(value)
-
-    return f"{m['name']} {'/'.join(designations)}"
+    if m.types is None:
+        return m.name
+
+    return f"{m.name} {designations(m.types)}"
 
 def format_group(m):
-    """Format event name, address, notes."""
+    """Format event name, non breaking street address, notes."""
 
-    maddr = re.match(r"(.*)\s"+m['region'], m['formatted_address'])[1].rstrip(', ')
-    maddr = re.sub('[ -]', '&nbsp;', maddr)         # make maddr non breaking
-    if 'notes' in m:
-        maddr += f"<br/>{m['notes']}"
-    return( f"<b>{group_name(m)}</b><br/>{m['location']}, {maddr}")
+    parts = [(BOLD, group_name(m)), BR, (TEXT, f"{m.location}, "),
+        (NOBREAK, strip_address(m.formatted_address, m.region))]
+    if m.notes is not None:
+        parts += [BR, (TEXT, m.notes)]
+    return(parts)
 
 def format_region(m):
-    return(f"<b>{m['region']}</b>")
+    return([(BOLD, m.region)])
+
+def time_key(m):
+    """24 hour "HH:MM" event time for sorting."""
+
+    if m.time:
+        return(m.time)
+    try:
+        return(datetime.strptime(m.time_formatted.strip(), "%I:%M %p").strftime("%H:%M"))
+    except ValueError:
+        return(m.time_formatted)
+
+# sort keys for msort_keys, any other name sorts on that event key
+SORT_KEYS = {
+    'time': time_key,
+}
+
+# event keys mquery may select on, see events2pdf_store.EventDB
+QUERY_FIELDS = ('day', 'region', 'attendance_option', 'types')
+
+def query_conditions(query):
+    """mquery as a list of (event key, set of values) conditions."""
+
+    conditions = []
+    for field, values in (query or {}).items():
+        if field not in QUERY_FIELDS:
+            raise ValueError(f"can't query event key {field}, only {QUERY_FIELDS}")
+        values = values if isinstance(values, list) else [values]
+        if field == 'day':
+            values = [int(v) for v in values]
+        conditions.append((field, frozenset(values)))
+    return(conditions)
+
+def event_query(conf):
+    """Every condition the events of conf meet, from mtypes, mregions and mquery."""
+
+    conditions = [('attendance_option', frozenset(conf['mtypes']))]
+    if conf.get('mregions'):
+        conditions.append(('region', frozenset(conf['mregions'])))
+    return(conditions + query_conditions(conf.get('mquery')))
+
+def matches(e, conditions):
+    """True if event e meets every condition, types if it has any of the codes."""
+
+    for field, values in conditions:
+        if field == 'types':
+            if not (e.types and e.types & values):
+                return(False)
+        elif e.get(field) not in values:
+            return(False)
+    return(True)
+
+def group_events(conf, events):
+    """Select event types and split events into sections in one pass.
+
+    Only regions in mregions are kept, if it isn't empty, and only events
+    that match mquery, if any.
+    Events are grouped by their day number, or, if msection_key names
+    another event key like region or attendance_option, by matching its
+    value to the msections headings.  Events that match no section are
+    dropped.  Each section is sorted by the msort_keys, if any.
+    """
+
+    mtypes = set(conf['mtypes'])
+    mregions = set(conf.get('mregions', []))
+    query = query_conditions(conf.get('mquery'))
+    section_key = conf.get('msection_key', 'day')
+    if section_key != 'day':
+        index = {heading: i for i, heading in enumerate(conf['msections'])}
+
+    if events and not isinstance(events[0], Event):     # feed dicts from the server or bench
+        events = [Event(e, extra_fields(conf)) for e in events]
+
+    sections = [[] for s in conf['msections']]
+    for e in events:
+        if e.attendance_option not in mtypes:
+            continue
+        if mregions and e.region not in mregions:
+            continue
+        if query and not matches(e, query):
+            continue
+        if section_key == 'day':
+            i = e.day
+        else:
+            i = index.get(str(e.get(section_key)))
+        if i is not None and 0 <= i < len(sections):
+            sections[i].append(e)
+
+    keys = [SORT_KEYS.get(k, lambda m, k=k: m.get(k, '')) for k in conf.get('msort_keys', [])]
+    if keys:
+        for section in sections:    # key is computed once per event
+            section.sort(key=lambda m: tuple(k(m) for k in keys))
+
+    logger.debug(f"group_events: {[len(x) for x in sections]} events per section")
+    return(sections)
+
+def measure_file(conf):
+    """The measure cache, see events2pdf_measure.py."""
+
+    return(os.path.abspath(os.path.join(conf.get('mcache_dir', CACHE_DIR), 'measure.pickle')))
 
 def get_events(conf, events):
     """Get events, format them for table."""
 
+    from reportlab.platypus import Paragraph
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_LEFT
+
     logger.debug(f"get_events: {len(events)} events at entry")
-    logger.debug(f"get_events: events[0] =  {events[0]}")
+    logger.debug(f"get_events: events[0] =  {events[0] if events else None}")
 
-    styles = getSampleStyleSheet()
+    styles = get_styles()
     styleE = ParagraphStyle('events',
         fontName = conf['mfont'],
         fontSize= conf['mfont_size'],
         parent = styles['Normal'],
         leading = conf['mfont_size']*conf['mleading'],
         wordWrap = 'LTR',
-        hyphenationLang = 'en',
+        hyphenationLang = hyphenation(conf),
         alignment = TA_LEFT
     )
 
-    try:              #  select event types specified in config
-        events = [x for x in events if x['attendance_option'] in conf['mtypes']]
-    except Exception as err:
-        logger.error(f"get_events: failure filtering event types: {err}")
-        return ([])
+    Cell = Paragraph
+    if conf.get('mmeasure_cache', False):     # reuse wrapped lines of unchanged cells
+        from events2pdf_measure import MeasuredParagraph
+        Cell = functools.partial(MeasuredParagraph, measure_file=measure_file(conf))
+
+    templates = frag_templates(styleE) if conf.get('mfast_cells', False) else None
+    parsed = 0
+    def cell(parts):
+        nonlocal parsed
+        text = markup(parts)
+        frags = templates and cell_frags(parts, text, templates)
+        if frags is None:       # markup of its own or no fast cells, parse it
+            parsed += 1
+        return(Cell(text, styleE, frags=frags))
 
-    sections = []
     logger.debug(f"len conf['msections'] = {len(conf['msections'])}")
-    try:                # split events into lists by sections
-        for s in range(len(conf['msections'])):
-            sections.append([x for x in events if x['day'] == s])
+    try:                # select event types, split events into lists by sections
+        with metrics().stage('group'):
+            sections = group_events(conf, events)
     except Exception as err:
         logger.error(f"get_events: failure splitting events by section: {err}")
         return ([])
+    metrics().count(selected=sum(len(x) for x in sections))
 
+    clear_formatter_caches()
     fmt_sections = []
     try:
-        for i in range(len(sections)):
-            data = []
-            for e in sections[i]:         # format event
-                data.append([
-                    Paragraph(format_time(e), styleE),
-                    Paragraph(format_group(e), styleE),
-                    Paragraph(format_region(e), styleE)
-                ])
-            fmt_sections.append(data)
+        with metrics().stage('format'):
+            for i in range(len(sections)):
+                data = []
+                for e in sections[i]:         # format event
+                    data.append([
+                        cell(format_time(e)),
+                        cell(format_group(e)),
+                        cell(format_region(e))
+                    ])
+                fmt_sections.append(data)
 
     except Exception as err:
         logger.error(f"get_events: failure formatting events: {err}\n{err}")
         return ([])
 
+    log_formatter_caches()
+    logger.debug(f"get_events: {parsed} of {3 * sum(len(x) for x in sections)} cells parsed")
     return(fmt_sections)
 
+# msection_break, where a section starts: next free space in the frame, next frame, next page
+SECTION_BREAKS = {
+    'none': None,
+    'frame': 'FrameBreak',
+    'page': 'PageBreak',
+}
+
 def show_events(conf, sections):
     """Create pdf, frames, table, add events."""
 
     logger.debug(f"show_events: len sections = {len(sections)}")
 
+    if conf['moutput'] == '-':
+        mout = sys.stdout.buffer
+    else:           # replaced when complete, readers never see half a pdf
+        mout = temp_file(conf['moutput'])
+
+    groups = conf.get('msection_groups', [])
+    if conf.get('mworkers', 1) > 1 and len(groups) > 1:
+        r = show_events_parallel(conf, sections, groups, mout)
+    else:
+        r = render_sections(conf, sections, mout)
+
+    if mout != sys.stdout.buffer:
+        if r == 0:
+            os.replace(mout, conf['moutput'])
+        elif os.path.exists(mout):
+            os.remove(mout)
+    return(r)
+
+def render_group(conf, sections, cover):
+    """Render sections to pdf bytes in a worker process."""
+
+    start_metrics()         # the parent times the whole build
+    out = io.BytesIO()
+    if render_sections(conf, sections, out, cover) != 0:
+        return(None)
+    return(out.getvalue())
+
+def show_events_parallel(conf, sections, groups, mout):
+    """Render each group of sections in a worker process, join the pdfs in order.
+
+    Each group starts on a new page, the cover page goes with the first
+    group.  Sections not in any group are rendered as a last group.
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except Exception as err:
+        logger.error(f"show_events: pypdf is needed to render in parallel, rendering serially: {err}")
+        return(render_sections(conf, sections, mout))
+
+    grouped = set(i for g in groups for i in g)
+    rest = [i for i in range(len(sections)) if i not in grouped]
+    if rest:
+        groups = groups + [rest]
+
+    workers = min(conf['mworkers'], len(groups))
+    logger.debug(f"show_events: rendering {groups} with {workers} workers")
+    try:
+        with metrics().stage('build'), ProcessPoolExecutor(workers) as pool:
+            futures = []
+            for n, g in enumerate(groups):
+                only = [s if i in g else [] for i, s in enumerate(sections)]
+                futures.append(pool.submit(render_group, conf, only, n == 0))
+            parts = [f.result() for f in futures]
+        if None in parts:
+            raise Exception(f"group {groups[parts.index(None)]} failed")
+
+        writer = PdfWriter()
+        for part in parts:
+            writer.append(PdfReader(io.BytesIO(part)))
+        writer.write(mout)
+        metrics().count(pages=len(writer.pages))
+    except Exception as err:
+        logger.error( f"show_events: can't build pdf: {err}")
+        return(-1)
+
+    return(0)
+
+CELL_TOP_PADDING = 0
+CELL_BOTTOM_PADDING = 2
+CELL_LEFT_PADDING = 0
+CELL_RIGHT_PADDING = 3
+
+def get_pagesize(conf):
+    """Page width and height in points."""
+
+    from reportlab.lib.pagesizes import legal, letter
+
     if conf['mpage_size'] == 'letter':
          pagesize = letter
     elif conf['mpage_size'] == 'legal':
@@ -297,15 +1219,41 @@ def show_events(conf, sections):
 
     if conf['mpage_orientation'] == 'landscape':
         pagesize = [pagesize[1], pagesize[0]]
+    return(pagesize)
 
-    if conf['moutput'] == '-':
-        mout = sys.stdout.buffer
-    else:
-        mout =  conf['moutput']
+def get_col_widths(conf, frame_width):
+    return([(int(x)/100)*frame_width for x in conf['mcol_widths']])
+
+def heading_style(conf):
+    """Section heading style, keepWithNext binds it to the first row."""
+
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER
+
+    return(ParagraphStyle('headings',
+        fontName = conf['mfont'],
+        fontSize=conf['mfont_size'] + 3,
+        parent=get_styles()['Normal'],
+        alignment= TA_CENTER,
+        hyphenationLang = hyphenation(conf),
+        keepWithNext = 1
+    ))
+
+def render_sections(conf, sections, mout, cover=True, max_pages=0):
+    """Lay out the cover page and sections, write the pdf to mout.
+
+    With max_pages layout stops once that many pages are full, for the
+    gui preview.
+    """
+
+    from reportlab import platypus
+    from reportlab.platypus import BaseDocTemplate, Frame, Paragraph,\
+        Table, TableStyle, PageTemplate
+    from reportlab.lib.units import inch
 
     doc = BaseDocTemplate(
         mout,
-        pagesize=pagesize,
+        pagesize=get_pagesize(conf),
         leftMargin = conf['mpage_margin']*inch,
         rightMargin = conf['mpage_margin']*inch,
         topMargin = conf['mpage_margin']*inch,
@@ -314,23 +1262,15 @@ def show_events(conf, sections):
         showBoundary=0                      # 1 to see frame outlines
     )
 
-    styles = getSampleStyleSheet()
     tablestyle =  TableStyle([
-        ('TOPPADDING', (0,0),(-1,-1), 0),
-        ('BOTTOMPADDING', (0,0),(-1,-1), 2),
-        ('LEFTPADDING', (0,0),(-1,-1), 0),
-        ('RIGHTPADDING', (0,0),(-1,-1),3),
+        ('TOPPADDING', (0,0),(-1,-1), CELL_TOP_PADDING),
+        ('BOTTOMPADDING', (0,0),(-1,-1), CELL_BOTTOM_PADDING),
+        ('LEFTPADDING', (0,0),(-1,-1), CELL_LEFT_PADDING),
+        ('RIGHTPADDING', (0,0),(-1,-1), CELL_RIGHT_PADDING),
         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
     ])
 
-    styleH = ParagraphStyle('headings',
-        fontName = conf['mfont'],
-        fontSize=conf['mfont_size'] + 3,
-        parent=styles['Normal'],
-        alignment= TA_CENTER,
-        hyphenationLang = 'en',
-        keepWithNext = 1
-    )
+    styleH = heading_style(conf)
 
     frame_count = conf['mframe_count']
     frame_width = doc.width / frame_count
@@ -351,69 +1291,683 @@ def show_events(conf, sections):
     template = PageTemplate(id = None, frames=frames)
     doc.addPageTemplates(template)
 
-    col_widths = []
-
-    for x in conf['mcol_widths']:
-        col_widths.append((int(x)/100)*frame_width)
+    col_widths = get_col_widths(conf, frame_width)
 
     # initialize elements list with cover page
-    elements = get_cover_page(conf, frame_width)
+    with metrics().stage('cover'):
+        elements = get_cover_page(conf, frame_width) if cover else []
+
+    section_break = SECTION_BREAKS.get(conf.get('msection_break', 'none'))
+    if section_break:
+        section_break = getattr(platypus, section_break)
 
     """
     add section heading styled keepWithNext, then table with 1 row
-    for keepWithNext to bind to, finally add table of remaining rows of section
+    for keepWithNext to bind to, finally add tables of remaining rows of section,
+    mrows_per_table rows each, or all of them in 1 table with 0
     """
     try:
         for i in range(len(sections)):
+            if len(sections[i]) == 0:       # nothing for this heading
+                continue
+            if section_break and elements:
+                elements.append(section_break())
             elements.append(Paragraph(f"<b>{conf['msections'][i]}</b>" , styleH))  # heading cwd
-            t = Table([sections[i].pop(0)], col_widths)     # 1 row table
-            t.setStyle(tablestyle)
-            elements.append(t)
-
-            t = Table(sections[i], col_widths)
+            t = Table(sections[i][:1], col_widths)     # 1 row table
             t.setStyle(tablestyle)
             elements.append(t)
 
-        doc.build(elements)
+            # sections aren't changed, editions share them
+            rows = conf.get('mrows_per_table', 0) or len(sections[i])
+            for j in range(1, len(sections[i]), rows):
+                t = Table(sections[i][j:j + rows], col_widths)
+                t.setStyle(tablestyle)
+                elements.append(t)
+
+        def progress(kind, value):
+            metrics().layout_progress(kind, value)
+            if max_pages and kind == 'PROGRESS' and doc.page > max_pages:
+                del elements[:]         # build stops when it runs out of flowables
+        doc.setProgressCallBack(progress)
+        with metrics().stage('build'):
+            doc.build(elements)
     except Exception as err:
         logger.error( f"show_events: can't build pdf: {err}")
         return(-1)
+    metrics().count(pages=doc.page)
 
+    if max_pages:           # a partial layout, the caches are saved by full builds
+        return(0)
+    if conf.get('mmeasure_cache', False):
+        from events2pdf_measure import get_cache
+        get_cache(measure_file(conf)).save()
+    hyphenator = hyphenation(conf)
+    if hyphenator:
+        hyphenator.save()
+
+    logger.debug(f"show_events: {doc.page} pages")
     return(0)
 
-def events2pdf_sub(conf):
-    """Called as sub"""
+r"""
+auto fit: find the font size, leading and frame count that put the events
+on mtarget_pages pages.  Word widths are measured once per cell at font
+size 1 and wrapped greedily for each candidate layout, which is then
+packed into frames like show_events() does.  Only the chosen layout is
+built.
+"""
 
-    r = do_events(conf)
-    if r == 0:
-       logger.info(f"created pdf file  {conf['moutput']}")
+FIT_FONT_SIZES = [x / 4 for x in range(20, 49)]       # 5 to 12 points
+FIT_LEADINGS = [1.0, 1.05, 1.1, 1.15, 1.2]
+FRAME_PADDING = 6                       # reportlab Frame default, each side
+
+_TAGS = re.compile(r'(<[^>]*>)')
+
+def cell_words(markup, font, bold_font):
+    """Widths at font size 1 of the words on each hard line of a cell."""
+
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    import html
+
+    lines = [[]]
+    bold = False
+    word = None                 # width of the word so far
+    for part in _TAGS.split(markup):
+        tag = part.replace(' ', '').lower()
+        if tag == '<b>':
+            bold = True
+        elif tag == '</b>':
+            bold = False
+        elif tag in ('<br/>', '<br>'):
+            if word is not None:
+                lines[-1].append(word)
+            lines.append([])
+            word = None
+        elif part and not part.startswith('<'):      # other tags are ignored
+            for n, piece in enumerate(html.unescape(part).split(' ')):
+                if n > 0 and word is not None:      # a space ends the word
+                    lines[-1].append(word)
+                    word = None
+                if piece:
+                    word = (word or 0) + stringWidth(piece, bold_font if bold else font, 1)
+    if word is not None:
+        lines[-1].append(word)
+    return(lines)
+
+def count_lines(lines, width, space):
+    """Number of lines a cell wraps to, widths at font size 1."""
+
+    n = 0
+    for words in lines:
+        n += 1
+        used = -space
+        for w in words:
+            if used > 0 and used + space + w > width:
+                n += 1
+                used = w
+            else:
+                used += space + w
+    return(n)
+
+def count_pages(conf, cover, heading, sections):
+    """Pages needed for the cover and sections, given flowable heights."""
+
+    frame_height = frame_size(conf)[1] - 2 * FRAME_PADDING
+    section_break = conf.get('msection_break', 'none')
+    frames = 1
+    free = frame_height
+
+    def place(h):
+        nonlocal frames, free
+        if h > free and free < frame_height:     # next frame
+            frames += 1
+            free = frame_height
+        free -= h
+
+    for h in cover:
+        place(h)
+    for rows in sections:
+        if len(rows) == 0:
+            continue
+        if free < frame_height:
+            if section_break == 'frame':
+                place(frame_height + 1)
+                free = frame_height
+            elif section_break == 'page':
+                frames += -frames % conf['mframe_count'] + 1
+                free = frame_height
+        place(heading + rows[0])            # heading is kept with the first row
+        for h in rows[1:]:
+            place(h)
+    return(-(-frames // conf['mframe_count']))
+
+def frame_size(conf):
+    """Width and height of one frame in points."""
+
+    from reportlab.lib.units import inch
+
+    pagesize = get_pagesize(conf)
+    margin = conf['mpage_margin'] * inch
+    return((pagesize[0] - 2 * margin) / conf['mframe_count'], pagesize[1] - 2 * margin)
+
+def fit_layout(conf, events):
+    """Return conf with the font size, leading and frame count that fit mtarget_pages.
+
+    The largest font size that fits wins, then the leading and frame count
+    closest to the config.  If nothing fits the smallest layout is used.
+    """
+
+    from reportlab.lib.fonts import tt2ps
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    target = conf['mtarget_pages']
+    font = conf['mfont']
+    try:
+        bold_font = tt2ps(font, 1, 0)
+    except Exception:
+        bold_font = font
+    space = stringWidth(' ', font, 1)
+
+    sections = group_events(conf, events)
+    words = [[(cell_words(markup(format_time(e)), font, bold_font),
+               cell_words(markup(format_group(e)), font, bold_font),
+               cell_words(markup(format_region(e)), font, bold_font)) for e in s] for s in sections]
+    padding = CELL_TOP_PADDING + CELL_BOTTOM_PADDING
+
+    measured = {}
+    def measure(fc, fs):
+        """Lines per row and cover heights, they don't depend on leading."""
+        if (fc, fs) not in measured:
+            c = dict(conf, mframe_count=fc, mfont_size=fs)
+            frame_width = frame_size(c)[0]
+            widths = [(w - CELL_LEFT_PADDING - CELL_RIGHT_PADDING) / fs for w in get_col_widths(c, frame_width)]
+            lines = [[max(count_lines(cell, w, space) for cell, w in zip(row, widths)) for row in s] for s in words]
+            cover = [f.wrap(frame_width - 2 * FRAME_PADDING, frame_size(c)[1])[1] for f in get_cover_page(c, frame_width)]
+            measured[(fc, fs)] = (lines, cover)
+        return(measured[(fc, fs)])
+
+    trials = 0
+    def pages(fc, fs, ld):
+        nonlocal trials
+        trials += 1
+        lines, cover = measure(fc, fs)
+        c = dict(conf, mframe_count=fc, mfont_size=fs)
+        rows = [[n * fs * ld + padding for n in s] for s in lines]
+        return(count_pages(c, cover, heading_style(c).leading, rows))
+
+    best = None
+    for fc in sorted(set(max(1, conf['mframe_count'] + d) for d in (-1, 0, 1))):
+        for ld in FIT_LEADINGS:
+            lo, hi = 0, len(FIT_FONT_SIZES) - 1       # largest size that fits
+            if pages(fc, FIT_FONT_SIZES[lo], ld) > target:
+                continue
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if pages(fc, FIT_FONT_SIZES[mid], ld) <= target:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            score = (FIT_FONT_SIZES[lo], -abs(ld - conf['mleading']), -abs(fc - conf['mframe_count']))
+            if best is None or score > best[0]:
+                best = (score, fc, FIT_FONT_SIZES[lo], ld)
+
+    if best is None:
+        fc, fs, ld = conf['mframe_count'] + 1, FIT_FONT_SIZES[0], FIT_LEADINGS[0]
+        logger.error(f"fit_layout: can't fit events on {target} pages, using font size {fs}, leading {ld}, {fc} frames")
+    else:
+        score, fc, fs, ld = best
+        logger.info(f"fit_layout: {target} pages: font size {fs}, leading {ld}, {fc} frames,"
+            f" estimated {pages(fc, fs, ld)} pages")
+    logger.info(f"fit_layout: {trials} trial layouts, {len(measured)} font size and frame count measurements"
+        f" of {sum(len(s) for s in words)} events")
+    return(dict(conf, mfont_size=fs, mleading=ld, mframe_count=fc))
+
+import shutil
+
+# the modules that make the pdf, see build_fingerprint()
+SOURCE_FILES = ('events2pdf.py', 'events2pdf_measure.py', 'events2pdf_store.py')
+
+def build_fingerprint(conf, events):
+    """Hash everything that goes into the pdf: events, config, cover page,
+    hyphenation exceptions, date, the source files and reportlab version."""
+
+    import reportlab
+
+    h = hashlib.sha256()
+    delta = getattr(events, 'delta', None)
+    if delta:               # every (key, content hash) pair, see sync_store()
+        h.update(delta.digest.encode())
+    else:
+        h.update(json.dumps(events, sort_keys=True, default=Event.to_dict).encode())
+    h.update(json.dumps({k: v for k, v in conf.items() if k not in ('moutput', 'mforce', 'mtemp_output')},
+        sort_keys=True, default=str).encode())
+    h.update(datetime.now().strftime("%m/%d/%Y").encode())      # cover page date
+    h.update(reportlab.Version.encode())
+    sources = [os.path.join(os.path.dirname(os.path.abspath(__file__)), x) for x in SOURCE_FILES]
+    for f in [conf['mcover_page'], conf.get('mhyphen_exceptions', '')] + sources:
+        if f and os.path.exists(f):
+            with open(f, "rb") as fp:
+                h.update(hashlib.sha256(fp.read()).digest())
+    return(h.hexdigest())
+
+_pruned = None          # date prune_builds() last removed the builds of earlier days
+
+def prune_builds(conf, cached):
+    """Remove the cached builds that won't be used again, see build_pdf().
+
+    The build moutput had before cached, and, once a day, every build
+    from an earlier day, the date is part of the fingerprint.  Temporary
+    outputs, see mtemp_output, aren't built again and have no last build.
+    """
+
+    global _pruned
+
+    old = None
+    if not conf.get('mtemp_output', False):
+        last = cache_path(conf, 'builds', os.path.abspath(conf['moutput']), '.last')
+        try:
+            with open(last, "r") as f:
+                old = f.read().strip()
+        except OSError:
+            pass
+        if old != cached:
+            tmp = temp_file(last)
+            with open(tmp, "w") as f:
+                f.write(cached)
+            os.replace(tmp, last)
+            if old:
+                try:
+                    os.remove(old)
+                    logger.debug(f"prune_builds: removed {old}")
+                except OSError:     # gone already, or open in another worker
+                    pass
+
+    today = datetime.now().date()
+    if _pruned == today:
+        return
+    _pruned = today
+    d = os.path.dirname(cached)
+    for name in os.listdir(d):
+        path = os.path.join(d, name)
+        try:
+            if datetime.fromtimestamp(os.path.getmtime(path)).date() != today:
+                os.remove(path)
+                logger.debug(f"prune_builds: removed {path}")
+        except OSError:
+            pass
+
+def copy_output(path, moutput):
+    """Copy a finished pdf to the output file or stdout."""
+
+    if moutput == '-':
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    else:
+        tmp = temp_file(moutput)
+        try:
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, moutput)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+def events2pdf_sub(conf, progress=None, cancel=None):
+    """Called as sub, return 0 on success.
+
+    progress and cancel are passed to Metrics, see gui.pyw.
+    """
+
+    setup_logging()
+    m = start_metrics(conf.get('mprofile', False), progress, cancel)
+
+    try:
+        if conf.get('meditions'):
+            r = do_editions(conf)
+        else:
+            r = do_events(conf)
+            if r == 0:
+                logger.info(f"created pdf file  {conf['moutput']}")
+    except Cancelled as err:
+        logger.info(f"events2pdf_sub: {err}")
+        r = -1
+    m.emit(conf)
+    return(r)
 
 def main():
     """Create pdf list of events."""
 
-    conf = get_config()
+    setup_logging()
+    m = start_metrics()
+
+    with m.stage('get_config'):
+        conf = get_config()
     if conf is None or len(conf) == 0:
         logger.error(f"main: can't get config")
         sys.exit(-1)
-    r = do_events(conf)
-    if r == 0:
+    m.profile = conf.get('mprofile', False)
+    if conf.get('mwatch'):
+        sys.exit(watch(conf))
+    if conf.get('meditions'):
+        do_editions(conf)
+    elif do_events(conf) == 0:
        logger.info(f"created pdf file  {conf['moutput']}")
+    m.emit(conf)
 
-def do_events(conf):
+WATCH_POLL = 1          # seconds between looks at the local files
+
+def watch_files(conf):
+    """Local files that go into the pdf."""
+
+    files = [conf.get('mconfig_file', ''), conf['mcover_page'], conf.get('mhyphen_exceptions', '')]
+    if isinstance(conf.get('meditions'), str):
+        files.append(conf['meditions'])
+    files += [x for x in sources(conf) if x.find('http') < 0]
+    return([f for f in files if f])
+
+def file_state(files):
+    """mtime and size of each file, None if missing."""
+
+    state = {}
+    for f in files:
+        try:
+            st = os.stat(f)
+            state[f] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            state[f] = None
+    return(state)
+
+def file_hash(path):
+    """sha256 of the contents of path, None if missing."""
 
+    h = hashlib.sha256()
     try:
-        events = load_events(conf['minput'])
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                h.update(block)
+    except OSError:
+        return(None)
+    return(h.hexdigest())
+
+def watch(conf):
+    """Build the pdf whenever its inputs change, until interrupted.
+
+    Local files are looked at every WATCH_POLL seconds, a url feed every
+    mwatch_interval seconds with a conditional get, see fetch_feed(), and
+    compared by the hash of its contents.
+    The date is watched too, it is on the cover page.
+    """
+
+    if '-' in sources(conf):
+        logger.error("watch: can't watch stdin")
+        return(-1)
+    state, next_fetch = None, 0
+    feeds = {}      # hash of each url feed, a server without etags rewrites it every check
+    try:
+        while True:
+            interval = conf.get('mwatch_interval', 300)
+            new = file_state(watch_files(conf))
+            new['date'] = datetime.now().strftime("%m/%d/%Y")
+            urls = [x for x in sources(conf) if x.find('http') >= 0]
+            if urls and time.time() >= next_fetch:
+                next_fetch = time.time() + interval
+                for url in urls:
+                    try:
+                        fetch_feed(url, dict(conf, mfeed_max_age=0))
+                    except Exception as err:
+                        logger.error(f"watch: can't get {url}: {err}")
+                    feeds[url] = file_hash(cache_path(conf, 'feeds', url, '.json'))
+            new.update((url, feeds.get(url)) for url in urls)
+
+            if new != state:
+                if state is not None and new.get(conf['mconfig_file']) != state.get(conf['mconfig_file']):
+                    c = get_config()
+                    if c:
+                        conf = dict(c, mwatch=True)
+                    new = None          # look again, the files may be others
+                else:
+                    logger.info(f"watch: building {conf['moutput']}")
+                    m = start_metrics(conf.get('mprofile', False))
+                    # the feed just fetched is used as is
+                    c = dict(conf, mfeed_cache=True, mfeed_max_age=interval)
+                    r = do_editions(c) if c.get('meditions') else do_events(c)
+                    if r == 0:
+                        logger.info(f"watch: created pdf file  {conf['moutput']}")
+                    m.emit(conf)
+                state = new
+            time.sleep(WATCH_POLL)
+    except KeyboardInterrupt:
+        pass
+    return(0)
+
+def get_input(conf):
+    """Load events from minput, None if there are none."""
+
+    try:
+        with metrics().stage('load_events'):
+            if isinstance(conf['minput'], list):
+                events = load_sources(conf, conf['minput'])
+            else:
+                events = load_events(conf['minput'], conf.get('mstream_input', False), conf)
+        metrics().count(events=len(events))
         if events is None or len(events) == 0:
             raise Exception("got 0 events")
     except Exception as err:
          logger.error(f"main: failed to get events from {conf['minput']}: {err}")
-         return(-1)
+         return(None)
+    if conf.get('mevent_store', False):
+        events = sync_store(conf, events)
+    if conf.get('mevent_db', False):
+        events = load_db(conf, events)
+    return(events)
 
-    sections = get_events(conf, events)
-    if len(sections) > 0:
-        show_events(conf, sections)
-        return(0)
+def sync_store(conf, events):
+    """Apply the events to the event store of minput, return them with the Delta.
+
+    See events2pdf_store.py, build_fingerprint() uses the Delta's digest.
+    """
+
+    from events2pdf_store import EventStore, SyncedEvents
+
+    path = cache_path(conf, 'store', json.dumps(sources(conf)), '.json')
+    with metrics().stage('sync'):
+        delta = EventStore(path).sync(events, event_key)
+    metrics().count(inserted=len(delta.inserted), updated=len(delta.updated), deleted=len(delta.deleted))
+    events = SyncedEvents(events)
+    events.delta = delta
+    return(events)
+
+def load_db(conf, events):
+    """Write the events to the event database of minput, return them with its path.
+
+    See events2pdf_store.py, select_events() queries it.
+    """
+
+    from events2pdf_store import EventDB, SyncedEvents
+
+    path = cache_path(conf, 'db', json.dumps(sources(conf)), '.sqlite')
+    try:
+        with metrics().stage('load_db'):
+            db = EventDB(path)
+            digest = db.sync(events, event_key).digest
+            db.close()
+    except Exception as err:
+        logger.error(f"load_db: can't write event database {path}: {err}")
+        return(events)
+    if not isinstance(events, SyncedEvents):
+        events = SyncedEvents(events)
+    events.db, events.db_digest = path, digest
+    return(events)
+
+def select_events(conf, events):
+    """The events that can match conf, found with an event database query.
+
+    Without a database, if the query fails, or if another load synced the
+    database with other events since, all of the events, group_events()
+    selects them.
+    """
+
+    path = getattr(events, 'db', None)
+    if not path:
+        return(events)
+
+    from events2pdf_store import EventDB
 
+    try:
+        with metrics().stage('query'):
+            db = EventDB(path)
+            places = db.select(event_query(conf), getattr(events, 'db_digest', None))
+            db.close()
+    except Exception as err:
+        logger.error(f"select_events: query of {path} failed: {err}")
+        return(events)
+    if places is None:
+        logger.info(f"select_events: {path} was synced with other events since these were loaded, not using it")
+        return(events)
+    selected = [events[pos] for pos in places]
+    logger.debug(f"select_events: {len(selected)} of {len(events)} events match")
+    return(selected)
+
+def do_events(conf):
+
+    events = get_input(conf)
+    if events is None:
+        return(-1)
+    return(build_pdf(conf, events))
+
+# config keys that change get_events() output, editions that agree on
+# these share the formatted sections
+FORMAT_KEYS = ('mtypes', 'mregions', 'mquery', 'msection_key', 'msections', 'msort_keys',
+    'mfont', 'mfont_size', 'mleading', 'mhyphenation', 'mhyphen_exceptions', 'mhyphen_cache',
+    'mfast_cells', 'mmeasure_cache', 'mcache_dir')
+
+def shared_events(conf, events, shared):
+    """get_events(), reused from the shared dict when the FORMAT_KEYS agree."""
+
+    if shared is None:
+        return(get_events(conf, events))
+    key = json.dumps([conf.get(k) for k in FORMAT_KEYS])
+    if key not in shared:
+        shared[key] = get_events(conf, events)
+    else:
+        logger.debug(f"shared_events: {conf['moutput']} reuses formatted events")
+    return(shared[key])
+
+def preview_pdf(conf, events, shared, pages=2):
+    """The first pages of the pdf as pdf bytes, None on failure.
+
+    shared keeps the formatted events between previews, see build_pdf.
+    """
+
+    events = select_events(conf, events)
+    if conf.get('mtarget_pages', 0) > 0:
+        conf = fit_layout(conf, events)
+    sections = shared_events(conf, events, shared)
+    if len(sections) == 0:
+        return(None)
+    out = io.BytesIO()
+    if render_sections(conf, sections, out, max_pages=pages) != 0:
+        return(None)
+    return(out.getvalue())
+
+_building = {}          # cached pdf: [lock, threads using it]
+_building_lock = threading.Lock()
+
+@contextlib.contextmanager
+def building(cached):
+    """Hold while building into cached, threads building the same pdf wait
+    for the first and use its build."""
+
+    with _building_lock:
+        entry = _building.setdefault(cached, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _building_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _building[cached]
+
+def build_pdf(conf, events, shared=None):
+    """Format events and create the pdf, return 0 on success.
+
+    shared is a dict of formatted sections from earlier editions.
+    """
+
+    if not conf.get('mbuild_cache', False):
+        return(format_pdf(conf, events, shared))
+
+    cached = cache_path(conf, 'builds', build_fingerprint(conf, events), '.pdf')
+    with building(cached):
+        if os.path.exists(cached) and not conf.get('mforce', False):
+            logger.info(f"build_pdf: events and config unchanged, using cached pdf {cached}")
+            metrics().count(cached_builds=1)
+        else:       # build into the cache, then copy to the real output
+            r = format_pdf(dict(conf, moutput=cached), events, shared)
+            if r != 0:
+                return(r)
+        with metrics().stage('write'):
+            copy_output(cached, conf['moutput'])
+        metrics().count(bytes=os.path.getsize(cached))
+        prune_builds(conf, cached)
+    return(0)
+
+def format_pdf(conf, events, shared):
+    """Select, format and lay out events, write the pdf to moutput."""
+
+    events = select_events(conf, events)
+    if conf.get('mtarget_pages', 0) > 0:
+        with metrics().stage('fit_layout'):
+            conf = fit_layout(conf, events)
+
+    sections = shared_events(conf, events, shared)
+    if len(sections) == 0:
+        return(-1)
+    r = show_events(conf, sections)
+    if r == 0 and conf['moutput'] != '-' and not conf.get('mbuild_cache', False):
+        metrics().count(bytes=os.path.getsize(conf['moutput']))
+    return(r)
+
+def do_editions(conf):
+    """Create a pdf for each edition in meditions from one load of the events.
+
+    Each edition is a dict of config settings that override conf, and
+    must set its own moutput.  With mworkers > 1 editions are built in
+    parallel worker processes, otherwise in turn sharing formatted events.
+    """
+
+    editions = conf['meditions']
+    try:
+        if isinstance(editions, str):
+            with open(editions, "r") as f:
+                editions = json.load(f)
+        confs = [dict(conf, meditions=None, **e) for e in editions]
+    except Exception as err:
+        logger.error(f"do_editions: can't get editions {conf['meditions']}: {err}")
+        return(-1)
+
+    events = get_input(conf)
+    if events is None:
+        return(-1)
+
+    workers = min(conf.get('mworkers', 1), len(confs))
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        confs = [dict(c, mworkers=1) for c in confs]     # no section workers in edition workers
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(build_pdf, confs, [events] * len(confs)))
+    else:
+        shared = {}
+        results = [build_pdf(c, events, shared) for c in confs]
+
+    for c, r in zip(confs, results):
+        if r == 0:
+            logger.info(f"do_editions: created pdf file  {c['moutput']}")
+        else:
+            logger.error(f"do_editions: failed to create {c['moutput']}")
+    return(0 if all(r == 0 for r in results) else -1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,378 @@
+#see LICENSE for license details
+__doc__="""
+events2pdf_bench:  time events2pdf on synthetic events
+
+usage: python events2pdf_bench.py [-n events] [-w workers] [-r runs] [-b budget]
+                                  [-o results] [-B baseline] [-x threshold] [-t rows]
+                                  [-d delay] [-f fail_every] benchmark
+  parallel - serial show_events vs sections rendered in worker processes
+  startup  - cold start of "events2pdf.py -h", fails if slower than budget
+             seconds or if importing events2pdf loads a heavy module
+  stages   - time and peak memory of each stage for -n 100,1000,10000 events,
+             the feed is served from a local http server so it runs offline.
+             Results are saved to -o, default events2pdf_bench.json, and the
+             run fails if a stage is more than -x, default 0.25, slower than
+             in the -B baseline results
+  sections - layout time per row of one section of -n 250,1000,4000 events
+             in 1 table and in tables of -t, default 50, rows, see
+             mrows_per_table
+  feed     - -r downloads of a feed of -n events from a local server that
+             waits -d seconds before each reply and answers every -f'th
+             request 503, fails if any download doesn't get every event
+"""
+
+import os, sys, io, json, time, random, getopt, tempfile, subprocess, shutil, threading, tracemalloc, gzip
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import events2pdf
+
+REGIONS = ['Gainesville', 'High Springs', 'Alachua', 'Newberry', 'Archer', 'Micanopy', 'Hawthorne']
+TYPES = ['O', 'C', 'D', 'MED', 'SP', 'B', 'LIT', 'ST', 'BE', 'CF', 'X', '12x12', 'BA', 'TR']
+ATTENDANCE = ['in_person', 'in_person', 'hybrid', 'online']
+
+SITE = "https://aagainesville.org"
+
+def synthetic_events(n, seed=1):
+    """n events in the feed format, every field of the example in ./docs/README."""
+
+    rnd = random.Random(seed)
+    events = []
+    for i in range(n):
+        region = rnd.choice(REGIONS)
+        hour, minute = rnd.randint(6, 21), rnd.choice([0, 15, 30])
+        name = f"{rnd.choice(['Sunrise', 'Serenity', 'Keep It Simple', 'Way Out'])} Group {i}"
+        location = f"{rnd.choice(['First United Methodist', 'St. Augustine', 'Grace Community'])} Church"
+        slug, location_slug = f"group-{i}", location.lower().replace(' ', '-').replace('.', '')
+        e = {
+            "id": i,
+            "name": name,
+            "slug": slug,
+            "updated": "2022-07-15 16:30:02",
+            "location_id": 1000 + i % 300,
+            "url": f"{SITE}/meetings/{slug}/",
+            "day": rnd.randint(0, 6),
+            "time": f"{hour:02d}:{minute:02d}",
+            "end_time": f"{hour + 1:02d}:{minute:02d}",
+            "time_formatted": f"{(hour - 1) % 12 + 1}:{minute:02d} {'am' if hour < 12 else 'pm'}",
+            "edit_url": f"{SITE}/wp-admin/post.php?post={i}&action=edit",
+            "types": rnd.sample(TYPES, rnd.randint(1, 4)),
+            "location": location,
+            "location_url": f"{SITE}/locations/{location_slug}/",
+            "formatted_address": f"{rnd.randint(100, 20000)} NW {rnd.randint(1, 99)}th St, {region}, FL 32643, USA",
+            "approximate": "no",
+            "latitude": 29.6 + rnd.random() / 4,
+            "longitude": -82.5 + rnd.random() / 4,
+            "region_id": 70 + REGIONS.index(region),
+            "region": region,
+            "regions": [region],
+            "attendance_option": rnd.choice(ATTENDANCE),
+        }
+        if rnd.random() < 0.2:
+            e['notes'] = "Enter at the side door, parking in rear"
+        events.append(e)
+    return(events)
+
+def timed(f, *args):
+    t = time.perf_counter()
+    r = f(*args)
+    return(r, time.perf_counter() - t)
+
+def bench_parallel(conf, n, workers):
+    """Time serial show_events against section groups in worker processes."""
+
+    events = synthetic_events(n)
+    sections = events2pdf.get_events(conf, events)
+    groups = [[i] for i in range(len(sections))]
+    out = os.path.join(tempfile.gettempdir(), "events2pdf_bench.pdf")
+
+    results = {}
+    for mode, c in [
+            ('serial', dict(conf, moutput=out, mworkers=1)),
+            ('parallel', dict(conf, moutput=out, mworkers=workers, msection_groups=groups))]:
+        r, results[mode] = timed(events2pdf.show_events, c, sections)
+        if r != 0:
+            print(f"events2pdf_bench: {mode} render failed, see events2pdf.log", file=sys.stderr)
+            return(None)
+    os.remove(out)
+
+    print(f"{n} events, {workers} workers: serial {results['serial']:.2f}s,"
+          f" parallel {results['parallel']:.2f}s, speedup {results['serial'] / results['parallel']:.2f}x")
+    return(results)
+
+STARTUP_BUDGET = 0.25                # seconds
+HEAVY_MODULES = ('reportlab', 'requests', 'urllib3', 'filetype', 'pypdf', 'PIL', 'pyphen')
+
+def bench_startup(runs, budget):
+    """Time cold starts of "events2pdf.py -h", check the lazy imports."""
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    cwd = tempfile.mkdtemp()                 # for the events2pdf.log it writes
+    times = []
+    for i in range(runs):
+        t = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(here, 'events2pdf.py'), '-h'],
+            cwd=cwd, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t)
+
+    r = subprocess.run([sys.executable, '-c', 'import sys, events2pdf; print(*sys.modules)'],
+        cwd=here, capture_output=True, text=True)
+    loaded = sorted(set(m.split('.')[0] for m in r.stdout.split()) & set(HEAVY_MODULES))
+
+    print(f"startup: best {min(times):.3f}s, median {sorted(times)[runs // 2]:.3f}s of {runs} runs,"
+          f" budget {budget:.3f}s, heavy modules at import: {loaded or 'none'}")
+    return(min(times) <= budget and not loaded)
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Stand in for the events site, serves the server's feed.
+
+    Each reply waits server.delay seconds, every server.fail_every'th
+    request is answered 503, the feed is gzipped if the client asks.
+    Connections are kept open and counted.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        time.sleep(server.delay)
+        if server.fail_every and server.requests % server.fail_every == 0:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = server.feed
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = server.feed_gzip
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):       # the client gave up, a timeout
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_feed(events, delay=0, fail_every=0):
+    """Serve events on a local port from a thread, return the server and its url."""
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    server.daemon_threads = True
+    server.feed = json.dumps(events).encode()
+    server.feed_gzip = gzip.compress(server.feed)
+    server.delay, server.fail_every = delay, fail_every
+    server.requests = server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return(server, f"http://127.0.0.1:{server.server_port}/feed.json")
+
+def bench_feed(conf, n, runs, delay, fail_every):
+    """Download a feed runs times from a slow, failing stand in server."""
+
+    server, url = serve_feed(synthetic_events(n), delay, fail_every)
+    c = dict(conf, mfeed_cache=False, mfeed_backoff=0.1)
+    times = []
+    try:
+        for i in range(runs):
+            events, t = timed(events2pdf.load_events, url, True, c)
+            if len(events) != n:
+                print(f"events2pdf_bench: got {len(events)} of {n} events, see events2pdf.log", file=sys.stderr)
+                return(False)
+            times.append(t)
+    finally:
+        server.shutdown()
+    print(f"feed: {n} events, {runs} downloads, delay {delay}s, every {fail_every or 'no'} request failing:"
+          f" best {min(times):.3f}s, median {sorted(times)[runs // 2]:.3f}s,"
+          f" {server.requests} requests over {server.connections} connections")
+    return(True)
+
+STAGES = ('load_events', 'get_events', 'layout', 'write')
+REGRESSION = 0.25          # fraction slower than the baseline that fails
+MIN_REGRESSION = 0.05      # seconds, smaller differences are noise
+
+def write_pdf(buf, path):
+    with open(path, "wb") as f:
+        f.write(buf.getbuffer())
+
+def run_stages(conf, trace):
+    """Run each stage once, return seconds or, with trace, peak MB per stage."""
+
+    results = {}
+    def stage(name, f, *args):
+        if trace:
+            tracemalloc.start()
+            r = f(*args)
+            results[name] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.stop()
+        else:
+            r, t = timed(f, *args)
+            results[name] = round(t, 4)
+        return(r)
+
+    events = stage('load_events', events2pdf.get_input, conf)
+    sections = stage('get_events', events2pdf.get_events, conf, events)
+    buf = io.BytesIO()          # layout builds the pdf in memory, write saves it
+    if not events or not sections or stage('layout', events2pdf.render_sections, conf, sections, buf) != 0:
+        return(None)
+    stage('write', write_pdf, buf, conf['moutput'])
+    return(results)
+
+def stages_run(conf, n):
+    """Stage seconds, stage peak MB and pdf size for n events, with empty caches."""
+
+    server, url = serve_feed(synthetic_events(n))
+    tmp = tempfile.mkdtemp()
+    try:
+        c = dict(conf, minput=url, moutput=os.path.join(tmp, "bench.pdf"), mcache_dir=os.path.join(tmp, "cache"))
+        seconds = run_stages(c, False)
+        size = os.path.getsize(c['moutput']) if seconds else 0
+        shutil.rmtree(c['mcache_dir'], ignore_errors=True)
+        peak = seconds and run_stages(c, True)         # tracemalloc slows the timed run down
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return(seconds, peak, size)
+
+def bench_stages(conf, sizes):
+    """Time each stage for each number of events."""
+
+    stages_run(conf, 10)            # load modules and fonts before timing
+    results = {}
+    for n in sizes:
+        seconds, peak, size = stages_run(conf, n)
+        if not peak:
+            print(f"events2pdf_bench: {n} events failed, see events2pdf.log", file=sys.stderr)
+            return(None)
+        results[str(n)] = {'seconds': seconds, 'peak_mb': peak, 'pdf_bytes': size}
+        print(f"{n} events: " + ", ".join(f"{s} {seconds[s]:.3f}s {peak[s]:.1f}MB" for s in STAGES))
+    return(results)
+
+SECTION_SIZES = [250, 1000, 4000]
+
+def bench_sections(conf, sizes, rows):
+    """Time the layout of one long section in 1 table and in tables of rows rows."""
+
+    conf = dict(conf, mtypes=sorted(set(ATTENDANCE)))      # every event is a row
+    results = {}
+    for n in [10] + sizes:          # the first loads modules and fonts
+        events = synthetic_events(n)
+        for e in events:
+            e['day'] = 0
+        sections = events2pdf.get_events(conf, events)
+        r = {}
+        for mode, c in [('table', dict(conf, mrows_per_table=0)), ('rows', dict(conf, mrows_per_table=rows))]:
+            status, r[mode] = timed(events2pdf.render_sections, c, sections, io.BytesIO())
+            if status != 0:
+                print(f"events2pdf_bench: {n} rows layout failed, see events2pdf.log", file=sys.stderr)
+                return(None)
+        if n in sizes:
+            results[n] = r
+            print(f"{n} rows: 1 table {r['table']:.2f}s {1000 * r['table'] / n:.2f}ms/row,"
+                  f" tables of {rows} rows {r['rows']:.2f}s {1000 * r['rows'] / n:.2f}ms/row")
+    return(results)
+
+def regressions(results, baseline, threshold):
+    """Stages more than threshold slower than in baseline."""
+
+    slower = []
+    for n, r in results.items():
+        old = baseline.get('sizes', {}).get(n)
+        if old is None:
+            continue
+        for s in STAGES:
+            t, t0 = r['seconds'][s], old['seconds'].get(s)
+            if t0 is not None and t > t0 * (1 + threshold) and t - t0 > MIN_REGRESSION:
+                slower.append(f"{n} events {s}: {t:.3f}s, baseline {t0:.3f}s")
+    return(slower)
+
+def main():
+    events2pdf.setup_logging()
+    sizes = None
+    workers = os.cpu_count() or 1
+    runs = 10
+    budget = STARTUP_BUDGET
+    results_file, baseline_file, threshold = "events2pdf_bench.json", None, REGRESSION
+    rows = 50
+    delay, fail_every = 0, 0
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:w:r:b:o:B:x:t:d:f:h")
+        for opt, arg in opts:
+            if opt in ['-n']:
+                sizes = [int(x) for x in arg.split(',')]
+            elif opt in ['-w']:
+                workers = int(arg)
+            elif opt in ['-r']:
+                runs = int(arg)
+            elif opt in ['-b']:
+                budget = float(arg)
+            elif opt in ['-o']:
+                results_file = arg
+            elif opt in ['-B']:
+                baseline_file = arg
+            elif opt in ['-x']:
+                threshold = float(arg)
+            elif opt in ['-t']:
+                rows = int(arg)
+            elif opt in ['-d']:
+                delay = float(arg)
+            elif opt in ['-f']:
+                fail_every = int(arg)
+            elif opt in ['-h']:
+                raise Exception("help")
+        if args not in [['parallel'], ['startup'], ['stages'], ['sections'], ['feed']]:
+            raise Exception(f"unknown benchmark {args}")
+    except Exception as err:
+        print(f"events2pdf_bench: {err}\n{__doc__}", file=sys.stderr)
+        sys.exit(-1)
+
+    if args == ['startup']:
+        if not bench_startup(runs, budget):
+            sys.exit(-1)
+        return
+
+    with open(events2pdf.CONFIG_FILE) as f:
+        conf = json.load(f)
+    conf['mbuild_cache'] = False
+    if args == ['parallel']:
+        if bench_parallel(conf, (sizes or [100])[0], workers) is None:
+            sys.exit(-1)
+        return
+
+    if args == ['feed']:
+        if not bench_feed(conf, (sizes or [1000])[0], runs, delay, fail_every):
+            sys.exit(-1)
+        return
+
+    if args == ['sections']:
+        conf['mmeasure_cache'] = False
+        if bench_sections(conf, sizes or SECTION_SIZES, rows) is None:
+            sys.exit(-1)
+        return
+
+    conf['mfeed_cache'] = False
+    results = bench_stages(conf, sizes or [100, 1000, 10000])
+    if results is None:
+        sys.exit(-1)
+    with open(results_file, "w") as f:
+        json.dump({'date': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0],
+            'sizes': results}, f, indent=4)
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            slower = regressions(results, json.load(f), threshold)
+        for line in slower:
+            print(f"events2pdf_bench: regression: {line}", file=sys.stderr)
+        if slower:
+            sys.exit(-1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#see LICENSE for license details
+__doc__="""
+events2pdf_http:  http client for feed downloads
+
+One requests Session per process keeps connections to the feed servers
+open between downloads, sources and --watch polls.  Every request has a
+connect and a read timeout, failed connections, timeouts and 429/5xx
+replies are retried mfeed_retries times with a growing wait, and a reply
+larger than mfeed_max_mb is refused.  gzip and deflate, and br if the
+brotli module is installed, are asked for.
+
+Each download logs its time: dns lookup, connect including tls, the wait
+for the first byte of the reply, retries included, and the download.
+
+Imported by events2pdf only for a url minput.
+"""
+
+import time, socket, threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.util import Retry, make_headers
+from urllib3.util.connection import allowed_gai_family
+
+import logging
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 10        # seconds, default mfeed_connect_timeout
+READ_TIMEOUT = 30           # seconds, default mfeed_timeout
+RETRIES = 3                 # default mfeed_retries
+BACKOFF = 1                 # seconds, default mfeed_backoff
+MAX_MB = 50                 # default mfeed_max_mb
+RETRY_STATUS = (429, 500, 502, 503, 504)
+POOL_SIZE = 10              # connections kept per host
+
+_local = threading.local()  # timing of the request running in this thread
+
+class TimedConnection:
+    """Adds the dns lookup and connect time of new connections to _local.timing."""
+
+    def _new_conn(self):
+        timing = getattr(_local, 'timing', None)
+        if timing is None:
+            return(super()._new_conn())
+        t = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except OSError:
+            return(super()._new_conn())         # urllib3 reports it
+        timing['dns'] += time.perf_counter() - t
+
+        host = self._dns_host
+        try:        # connect to the addresses looked up instead of looking them up again
+            for n, address in enumerate(addresses):
+                self._dns_host = address[4][0]
+                try:
+                    return(super()._new_conn())
+                except Exception:
+                    if n == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+
+    def connect(self):
+        timing = getattr(_local, 'timing', None)
+        if timing is None:
+            return(super().connect())
+        t, dns = time.perf_counter(), timing['dns']
+        super().connect()
+        timing['connect'] += time.perf_counter() - t - (timing['dns'] - dns)
+        timing['connections'] += 1
+
+class TimedHTTPConnection(TimedConnection, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections are timed."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+_sessions = {}
+_lock = threading.Lock()
+
+def session(conf):
+    """The pooled Session for the retry settings of conf, made once per process."""
+
+    key = (conf.get('mfeed_retries', RETRIES), conf.get('mfeed_backoff', BACKOFF))
+    with _lock:
+        if key not in _sessions:
+            retries, backoff = key
+            retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS,
+                allowed_methods=['GET'], raise_on_status=False)
+            adapter = TimedAdapter(max_retries=retry, pool_maxsize=POOL_SIZE)
+            s = requests.Session()
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            s.headers['Accept-Encoding'] = make_headers(accept_encoding=True)['accept-encoding']
+            _sessions[key] = s
+    return(_sessions[key])
+
+def max_bytes(conf):
+    return(int(conf.get('mfeed_max_mb', MAX_MB) * 2**20))
+
+def get(url, conf, headers=None):
+    """Start a streamed GET of url, the response once its headers are in.
+
+    Raises for a failed request, an error status other than 304, or a
+    Content-Length over mfeed_max_mb.
+    """
+
+    timeout = (conf.get('mfeed_connect_timeout', CONNECT_TIMEOUT), conf.get('mfeed_timeout', READ_TIMEOUT))
+    timing = _local.timing = {'dns': 0.0, 'connect': 0.0, 'connections': 0}
+    t = time.perf_counter()
+    try:
+        r = session(conf).get(url, headers=headers, stream=True, timeout=timeout)
+    finally:
+        _local.timing = None
+    timing['first_byte'] = time.perf_counter() - t - timing['dns'] - timing['connect']
+    timing['start'] = time.perf_counter()
+    r.timing = timing
+
+    if r.status_code != 304:
+        r.raise_for_status()
+    length = int(r.headers.get('Content-Length') or 0)
+    if length > max_bytes(conf):
+        r.close()
+        raise ValueError(f"{url} is {length} bytes, more than mfeed_max_mb")
+    return(r)
+
+def iter_body(r, conf, chunk_size):
+    """Yield the decoded body of response r in chunks, log the timing when done.
+
+    Also logged if the reader stops early, iter_json_list() stops at the
+    end of the list.
+    """
+
+    limit, size = max_bytes(conf), 0
+    try:
+        for chunk in r.iter_content(chunk_size):
+            size += len(chunk)
+            if size > limit:
+                r.close()
+                raise ValueError(f"{r.url} is more than mfeed_max_mb, {limit} bytes")
+            yield chunk
+    finally:
+        log_timing(r, size)
+
+def log_timing(r, size):
+    """Log where the time of response r went."""
+
+    timing = r.timing
+    retries = len(r.raw.retries.history) if r.raw.retries else 0
+    logger.info(f"log_timing: GET {r.url} {r.status_code}, {size} bytes, {r.raw.tell()} on the wire"
+        f" ({r.headers.get('Content-Encoding', 'identity')}), dns {timing['dns']:.3f}s,"
+        f" connect {timing['connect']:.3f}s, first byte {timing['first_byte']:.3f}s,"
+        f" download {time.perf_counter() - timing['start']:.3f}s,"
+        f" {timing['connections']} new connections, {retries} retries")
@@ -0,0 +1,164 @@
+#see LICENSE for license details
+__doc__="""
+events2pdf_measure:  paragraph measurement cache for events2pdf
+
+The wrapped lines and height of each table cell are kept by (text,
+style, width) and saved in the cache directory between runs, in a file
+named for the reportlab version and FORMAT, as the pickled lines are
+reportlab objects.  Cells that didn't change since the last run skip
+line breaking and hyphenation, and cells wrapped again at the same width
+while the pdf is laid out, for example when a table is split at a frame
+break, reuse their lines.
+
+One cache is shared by the threads of a process, the server's and the
+gui's, and the processes of parallel editions merge what they save.
+
+Imported by events2pdf only when mmeasure_cache is on.
+"""
+
+import os, time, pickle, zlib, hashlib, threading
+
+import reportlab
+from reportlab.platypus import Paragraph
+
+import logging
+logger = logging.getLogger(__name__)
+
+FORMAT = 2          # change when the cache entries change
+MAX_AGE = 7 * 24 * 3600     # seconds an entry is kept unused
+
+class MeasureCache:
+    """Wrapped lines and heights by (text, style, width), saved between runs.
+
+    The file keeps each entry with the time it was last used, entries not
+    used for MAX_AGE are dropped when saving, so it holds the cells of
+    recent events instead of growing forever.  Saves merge with the
+    entries other processes saved, editions and workers share the file.
+    """
+
+    def __init__(self, path):
+        root, ext = os.path.splitext(path)
+        self.path = f"{root}_{reportlab.Version}_{FORMAT}{ext}"
+        self.lock = threading.Lock()            # entries, used and the counts
+        self.save_lock = threading.Lock()       # saved and the file
+        self.used = {}                          # since the last save
+        self.hits = self.misses = 0
+        self.stamp = self.file_stamp()
+        self.saved = self.load()                # as in the file, key: (value, last used)
+        self.entries = {k: v for k, (v, t) in self.saved.items()}
+
+    def file_stamp(self):
+        """mtime and size of the cache file, None if missing."""
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return(None)
+        return((st.st_mtime_ns, st.st_size))
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                return(pickle.loads(zlib.decompress(f.read())))
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.error(f"MeasureCache: ignoring measure cache {self.path}: {err}")
+        return({})
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.used[key] = value
+        return(value)
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = self.used[key] = value
+
+    def save(self):
+        """Write the entries used since the last save, merged with the file,
+        log the hit rate."""
+
+        with self.lock:
+            used, self.used = self.used, {}
+            hits, calls = self.hits, self.hits + self.misses
+            self.hits = self.misses = 0
+        logger.debug(f"MeasureCache: {hits}/{calls} hits ({100 * hits / calls if calls else 0:.0f}%),"
+            f" {len(used)} entries used")
+        if not used:            # saved by another thread
+            return
+        with self.save_lock:
+            now = time.time()
+            saved = self.saved if self.file_stamp() == self.stamp else self.load()
+            saved = {k: vt for k, vt in saved.items() if now - vt[1] < MAX_AGE}
+            saved.update((k, (v, now)) for k, v in used.items())
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp, "wb") as f:
+                    f.write(zlib.compress(pickle.dumps(saved, pickle.HIGHEST_PROTOCOL)))
+                os.replace(tmp, self.path)
+                self.stamp = self.file_stamp()
+            except Exception as err:
+                logger.error(f"MeasureCache: can't save measure cache {self.path}: {err}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            self.saved = saved
+            entries = {k: v for k, (v, t) in saved.items()}
+        with self.lock:         # and the entries of other processes, without the old ones
+            entries.update(self.used)
+            self.entries = entries
+
+CACHES = {}
+_lock = threading.Lock()
+
+def get_cache(path):
+    """The cache for path, loaded once per process."""
+
+    with _lock:
+        if path not in CACHES:
+            CACHES[path] = MeasureCache(path)
+        return(CACHES[path])
+
+def style_fingerprint(style):
+    """Hash of the style settings that change line breaking and drawing."""
+
+    fp = style.__dict__.get('_measure_fingerprint')
+    if fp is None:
+        settings = sorted((k, repr(v)) for k, v in style.__dict__.items() if k not in ('name', 'parent'))
+        fp = style._measure_fingerprint = hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+    return(fp)
+
+class MeasuredParagraph(Paragraph):
+    """Paragraph whose wrap is looked up in the measure cache at measure_file."""
+
+    def __init__(self, text, style=None, *args, measure_file=None, **kwargs):
+        super().__init__(text, style, *args, **kwargs)
+        self.measure_file = measure_file
+
+    def wrap(self, availWidth, availHeight):
+        if not self.measure_file or availWidth < 1e-8:
+            return(super().wrap(availWidth, availHeight))
+
+        key = (self.text, style_fingerprint(self.style), round(availWidth, 3))
+        if self.__dict__.get('_measure_key') == key and hasattr(self, 'blPara'):
+            return(self.width, self.height)         # wrapped at this width already
+
+        cache = get_cache(self.measure_file)
+        hit = cache.get(key)
+        if hit is None:
+            super().wrap(availWidth, availHeight)
+            cache.put(key, (self.blPara, self.height))
+        else:
+            style = self.style
+            self.blPara, self.height = hit
+            self.width = availWidth
+            self._wrapWidths = [availWidth - (style.leftIndent + style.firstLineIndent) - style.rightIndent,
+                availWidth - style.leftIndent - style.rightIndent]
+        self._measure_key = key
+        return(self.width, self.height)
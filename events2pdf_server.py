@@ -0,0 +1,179 @@
+#see LICENSE for license details
+__doc__="""
+events2pdf_server:  keep events2pdf loaded and create pdfs on request
+
+usage: python events2pdf_server.py [-c config_file] [-a address] [-p port] [-w workers]
+
+Imports, styles, fonts, hyphenation and the cover page are loaded once at
+startup instead of for every pdf.
+
+POST / with a json body, every key is optional:
+    {"conf": {config settings}, "minput": "url" or ["url", ...], "events": [event dicts]}
+conf overrides the server config file, except the settings that name
+files on the server or set what a request may use of it, see PATH_KEYS
+and LIMIT_KEYS.  events are used instead of downloading minput.  The
+reply is the pdf, application/pdf.
+GET /health replies ok.
+"""
+
+import os, sys, json, getopt, tempfile, shutil, io
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+import events2pdf
+
+import logging
+logger = logging.getLogger(__name__)
+
+ADDRESS = '127.0.0.1'
+PORT = 8080
+MAX_REQUEST = 50 * 1024 * 1024
+
+# settings naming files on the server, a request can't override them
+PATH_KEYS = ('minput', 'moutput', 'meditions', 'mconfig_file', 'mcover_page', 'mhyphen_exceptions',
+    'mcache_dir', 'mmetrics_file')
+
+# settings limiting the processes, time and memory of a request, set by the server
+LIMIT_KEYS = ('mworkers', 'msection_groups', 'mprofile', 'mfeed_max_mb', 'mfeed_timeout',
+    'mfeed_connect_timeout', 'mfeed_retries', 'mfeed_backoff')
+
+# a small schedule rendered at startup to load fonts, hyphenation and the cover page
+WARMUP_EVENTS = [{
+    "day": d, "time": "07:30", "time_formatted": "7:30 am", "name": "Warm Up", "types": ["O"],
+    "location": "First United Methodist Church", "formatted_address": "17405 US-441, High Springs, FL 32643, USA",
+    "region": "High Springs", "attendance_option": "in_person"} for d in range(7)]
+
+def warm_up(conf):
+    """Render a throw away pdf so later requests start warm."""
+
+    sections = events2pdf.get_events(dict(conf, mtypes=["in_person"]), WARMUP_EVENTS)
+    if events2pdf.render_sections(conf, sections, io.BytesIO()) != 0:
+        logger.error("warm_up: warm up render failed")
+
+def render(conf, request):
+    """Create a pdf for one request, return the pdf file name."""
+
+    conf = dict(conf, **request.get('conf', {}))
+    conf['mforce'] = False
+    conf['meditions'] = None
+    if 'minput' in request:
+        conf['minput'] = request['minput']
+
+    fd, conf['moutput'] = tempfile.mkstemp(suffix='.pdf')
+    conf['mtemp_output'] = True         # no last build to keep for it, see prune_builds()
+    os.close(fd)
+    m = events2pdf.start_metrics()
+    try:
+        if 'events' in request:
+            events = request['events']
+        else:
+            events = events2pdf.get_input(conf)
+        if not events or events2pdf.build_pdf(conf, events) != 0:
+            raise RuntimeError("can't create pdf, see events2pdf.log")
+    except Exception:
+        os.remove(conf['moutput'])
+        raise
+    finally:
+        m.emit(conf)
+    return(conf['moutput'])
+
+class Handler(BaseHTTPRequestHandler):
+
+    conf = {}
+    pool = None
+
+    def reply(self, code, text):
+        body = text.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.reply(200, "ok\n")
+        else:
+            self.reply(404, "not found\n")
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST:
+                raise ValueError(f"request too large, {length} bytes")
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("request must be a json dict")
+            overrides = request.get('conf', {})
+            if not isinstance(overrides, dict):
+                raise ValueError("conf must be a json dict")
+            fixed = sorted(set(overrides) & set(PATH_KEYS + LIMIT_KEYS))
+            if fixed:
+                raise ValueError(f"conf can't set {', '.join(fixed)}")
+            if not all(str(x).startswith('http') for x in events2pdf.sources(dict(minput=request.get('minput', 'http')))):
+                raise ValueError("minput must be a url or a list of urls")
+        except Exception as err:
+            self.reply(400, f"bad request: {err}\n")
+            return
+
+        try:                # wait for a free worker
+            path = self.pool.submit(render, self.conf, request).result()
+        except Exception as err:
+            logger.error(f"do_POST: {err}")
+            self.reply(500, f"failed: {err}\n")
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.end_headers()
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile)
+        finally:
+            os.remove(path)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+def usage():
+    print(__doc__, file=sys.stderr)
+
+def main():
+    events2pdf.setup_logging()
+    config_file = events2pdf.CONFIG_FILE
+    address, port, workers = ADDRESS, PORT, os.cpu_count() or 1
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:a:p:w:h")
+        for opt, arg in opts:
+            if opt in ['-c']:
+                config_file = arg
+            elif opt in ['-a']:
+                address = arg
+            elif opt in ['-p']:
+                port = int(arg)
+            elif opt in ['-w']:
+                workers = int(arg)
+            elif opt in ['-h']:
+                usage()
+                sys.exit(0)
+        with open(config_file) as f:
+            conf = json.load(f)
+    except Exception as err:
+        print(f"events2pdf_server: {err}", file=sys.stderr)
+        usage()
+        sys.exit(-1)
+
+    warm_up(conf)
+    Handler.conf = conf
+    Handler.pool = ThreadPoolExecutor(workers)
+    server = ThreadingHTTPServer((address, port), Handler)
+    logger.info(f"main: serving on {address}:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    Handler.pool.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#see LICENSE for license details
+__doc__="""
+events2pdf_store:  local event store for events2pdf
+
+The events of the last run are kept by key, slug or id, see event_key()
+in events2pdf, with a hash of their fields.  Each run the feed is
+compared with the store: a new key is an insert, a different hash an
+update and a key no longer in the feed a delete.  Only these changes
+are applied to the store.
+
+The Delta of a run names the changed keys and has a digest of every
+(key, hash) pair in feed order, which later stages use instead of
+hashing all of the events again.
+
+EventDB keeps the fields editions select on in an sqlite database with
+an index on each, so an edition's query, see mquery, runs in the
+database instead of scanning every event.
+
+Imported by events2pdf only when mevent_store or mevent_db is on.
+"""
+
+import os, json, hashlib, threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Delta:
+    """Keys inserted, updated and deleted by one sync, digest of the events synced."""
+
+    def __init__(self, inserted, updated, deleted, digest):
+        self.inserted, self.updated, self.deleted = inserted, updated, deleted
+        self.digest = digest
+
+    @property
+    def changed(self):
+        return(self.inserted | self.updated | self.deleted)
+
+    def summary(self):
+        return(f"{len(self.inserted)} inserted, {len(self.updated)} updated, {len(self.deleted)} deleted")
+
+class SyncedEvents(list):
+    """Events list with the Delta of the sync that loaded them, and the EventDB
+    path and digest of the events written to it."""
+
+    delta = None
+    db = None
+    db_digest = None
+
+def event_dict(e):
+    return(e.to_dict() if hasattr(e, 'to_dict') else e)
+
+def version(e):
+    """A hash of every field of the event, not only its updated time.
+
+    An edit that does not touch updated still has to reach the store and
+    the build fingerprint.
+    """
+
+    return("sha1:" + hashlib.sha1(json.dumps(event_dict(e), sort_keys=True, default=str).encode()).hexdigest())
+
+def diff(old, new):
+    """Keys inserted, updated and deleted going from the old to the new versions."""
+
+    inserted = set(new) - set(old)
+    deleted = set(old) - set(new)
+    updated = set(k for k, v in new.items() if k in old and old[k] != v)
+    return(inserted, updated, deleted)
+
+class EventStore:
+    """Version of each event by key, saved in path between runs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.versions = {}
+        try:
+            with open(path, "r") as f:
+                self.versions = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.error(f"EventStore: ignoring event store {path}: {err}")
+
+    def sync(self, events, key):
+        """Apply the changes in events to the store, return them as a Delta."""
+
+        new, unkeyed, order = {}, [], []
+        for e in events:
+            k, v = key(e), version(e)
+            order.append((k, v))        # feed order, the pdf keeps it
+            if k is None:
+                unkeyed.append(e)
+            else:
+                new[str(k)] = v
+
+        old = self.versions
+        inserted, updated, deleted = diff(old, new)
+
+        digest = hashlib.sha256(json.dumps(order, default=str).encode()).hexdigest()
+        delta = Delta(inserted, updated, deleted, digest)
+
+        if delta.changed:
+            for k in deleted:
+                del old[k]
+            for k in inserted | updated:
+                old[k] = new[k]
+            self.save()
+        logger.info(f"EventStore: {delta.summary()}, {len(new)} events stored, {len(unkeyed)} without a key")
+        if delta.changed:
+            logger.debug(f"EventStore: changed keys {sorted(delta.changed)[:50]}")
+        return(delta)
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"     # loads in other threads save too
+            with open(tmp, "w") as f:
+                json.dump(self.versions, f)
+            os.replace(tmp, self.path)
+        except Exception as err:
+            logger.error(f"EventStore: can't save {self.path}: {err}")
+
+# columns queries select on, types are in event_types, one row per code
+COLUMNS = ('day', 'region', 'attendance_option')
+
+SCHEMA = """
+create table if not exists events (key text primary key, version text, pos integer,
+    day integer, region text, attendance_option text);
+create table if not exists event_types (key text, code text);
+create index if not exists events_day on events (day);
+create index if not exists events_region on events (region);
+create index if not exists events_attendance_option on events (attendance_option);
+create index if not exists event_types_code on event_types (code, key);
+create index if not exists event_types_key on event_types (key);
+create table if not exists meta (name text primary key, value text);
+"""
+
+class EventDB:
+    """The events' query fields in an sqlite database at path, indexed.
+
+    Rows are keyed like the EventStore, events without a key or with a
+    key seen before in the feed by their place in it.  pos is the place of
+    the event in the feed, select() returns the places of the matches.
+
+    Other loads of the same feed sync the same database, the digest in
+    meta names the events it holds, see select().
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)     # other editions and threads
+        self.db.executescript(SCHEMA)
+
+    def sync(self, events, key):
+        """Write the events changed since the last sync, return them as a Delta."""
+
+        new, rows = {}, {}
+        for pos, e in enumerate(events):
+            k = key(e)
+            k = f"#{pos}" if k is None else str(k)
+            if k in rows:
+                k = f"{k}#{pos}"
+            new[k] = version(e)
+            rows[k] = (pos, e)
+
+        digest = hashlib.sha256(json.dumps([(k, v, rows[k][0]) for k, v in new.items()]).encode()).hexdigest()
+
+        with self.db:           # one transaction, a sync by another load waits
+            self.db.execute("begin immediate")
+            old, places = {}, {}
+            for k, v, pos in self.db.execute("select key, version, pos from events"):
+                old[k], places[k] = v, pos
+            inserted, updated, deleted = diff(old, new)
+            changed = inserted | updated
+            moved = [(rows[k][0], k) for k in new if k not in changed and places[k] != rows[k][0]]
+
+            added, codes = [], []
+            for k in changed:
+                pos, e = rows[k]
+                added.append((k, new[k], pos, e.get('day'), e.get('region'), e.get('attendance_option')))
+                codes += [(k, code) for code in e.get('types') or ()]
+
+            gone = [(k,) for k in deleted | updated]
+            self.db.executemany("delete from events where key = ?", gone)
+            self.db.executemany("delete from event_types where key = ?", gone)
+            self.db.executemany("insert into events values (?, ?, ?, ?, ?, ?)", added)
+            self.db.executemany("insert into event_types values (?, ?)", codes)
+            self.db.executemany("update events set pos = ? where key = ?", moved)
+            self.db.execute("insert or replace into meta values ('digest', ?)", (digest,))
+
+        delta = Delta(inserted, updated, deleted, digest)
+        logger.info(f"EventDB: {delta.summary()}, {len(moved)} moved, {len(new)} events")
+        return(delta)
+
+    def select(self, conditions, digest=None):
+        """Places in the feed of the events meeting every (field, values) condition.
+
+        An event meets a types condition if it has any of the codes.  None
+        if the database holds other events than the sync that returned
+        digest, the places are of another feed.
+        """
+
+        where, args = [], []
+        for field, values in conditions:
+            marks = ", ".join("?" * len(values))
+            if field == 'types':
+                where.append(f"key in (select key from event_types where code in ({marks}))")
+            elif field in COLUMNS:
+                where.append(f"{field} in ({marks})")
+            else:
+                raise ValueError(f"can't query event key {field}")
+            args += sorted(values)
+        sql = "select pos from events" + (" where " + " and ".join(where) if where else "") + " order by pos"
+        with self.db:           # the digest and places of one sync
+            self.db.execute("begin")
+            row = self.db.execute("select value from meta where name = 'digest'").fetchone()
+            if digest and (row is None or row[0] != digest):
+                return(None)
+            return([pos for pos, in self.db.execute(sql, args)])
+
+    def close(self):
+        self.db.close()
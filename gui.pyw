@@ -1,12 +1,106 @@
-import os, sys, json, re
-from PyQt6 import QtWidgets, uic
-from PyQt6.QtWidgets import QMessageBox
+import os, sys, json, re, threading, logging
+from PyQt6 import QtCore, QtGui, QtWidgets, uic
+from PyQt6.QtWidgets import QMessageBox, QProgressBar, QPushButton, QDockWidget, QLabel, QScrollArea
 from events2pdfMW import Ui_MainWindow
 from events2pdf import *
 
 CONFIG_FILE = "events2pdf_conf.json"
 DEFAULT_CONFIG_FILE = "events2pdf_default_conf.json"
 
+PREVIEW_PAGES = 2
+PREVIEW_WIDTH = 600             # pixels
+PREVIEW_DELAY = 400             # ms after the last change
+
+# status bar text for each stage events2pdf reports
+STAGE_NAMES = {
+    'load_events': "Fetching events",
+    'load_db': "Indexing events",
+    'query': "Querying events",
+    'fit_layout': "Fitting to pages",
+    'group': "Filtering events",
+    'format': "Formatting events",
+    'cover': "Cover page",
+    'build': "Layout",
+    'write': "Writing pdf",
+}
+
+class ErrorLog(logging.Handler):
+    """Keeps the errors logged by one thread."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.thread = threading.get_ident()
+        self.errors = []
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.errors.append(record.getMessage())
+
+class PdfWorker(QtCore.QThread):
+    """Runs events2pdf_sub off the event loop, so the window keeps working."""
+
+    progress = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal(str)
+
+    def __init__(self, conf, parent=None):
+        super().__init__(parent)
+        self.conf = conf
+        self.cancel = threading.Event()
+
+    def report(self, stage, value):
+        if stage == 'layout':
+            self.progress.emit(f"Layout page {value}")
+        else:
+            self.progress.emit(STAGE_NAMES.get(stage, stage))
+
+    def run(self):
+        errors = ErrorLog()
+        logging.getLogger().addHandler(errors)
+        try:
+            r = events2pdf_sub(self.conf, self.report, self.cancel)
+        except Exception as err:
+            errors.errors.append(str(err))
+            r = -1
+        finally:
+            logging.getLogger().removeHandler(errors)
+
+        if self.cancel.is_set():
+            self.done.emit("")
+        elif r == 0:
+            self.done.emit(f'{self.conf["moutput"]} created')
+        else:
+            self.done.emit(f'{self.conf["moutput"]} not created: {errors.errors[-1] if errors.errors else "see events2pdf.log"}')
+
+class PreviewWorker(QtCore.QThread):
+    """Lays out the first pages for the preview.
+
+    The events are loaded once per source and the formatted events are
+    kept for each font, so most changes only lay out PREVIEW_PAGES pages.
+    """
+
+    done = QtCore.pyqtSignal(bytes)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.conf = None
+        self.source, self.events, self.shared = None, None, {}
+
+    def run(self):
+        start_metrics()
+        conf = self.conf
+        if conf["minput"] != self.source:
+            self.events = get_input(conf)
+            self.source, self.shared = conf["minput"], {}
+        if len(self.shared) > 8:            # fonts tried earlier
+            self.shared.clear()
+        pdf = None
+        if self.events:
+            try:
+                pdf = preview_pdf(conf, self.events, self.shared, PREVIEW_PAGES)
+            except Exception as err:
+                logging.getLogger(__name__).error(f"preview: {err}")
+        self.done.emit(pdf or b'')
+
 class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
     def showMessage(self, text):
@@ -22,7 +116,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         msg.exec()
 
     def load_gui(self):
-        self.source_lineEdit.setText(self.conf["minput"])
+        self.source_lineEdit.setText(" ".join(sources(self.conf)))
         self.outputFileName_lineEdit.setText(self.conf["moutput"] ) 
         self.coverPage_lineEdit.setText(self.conf["mcover_page"] )
         self.orient_comboBox.setCurrentText(self.conf ["mpage_orientation"] )
@@ -34,6 +128,66 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.no_cols_spinBox.setValue(self.conf["mcols"] )
         self.col_widths_lineEdit.setText(f'{" ".join(str(x) for x in [x for x in self.conf[ "mcol_widths"]])}')
         
+    def read_gui(self, conf):
+        conf["minput"] = self.source_lineEdit.text().strip()
+        if len(conf["minput"].split()) > 1 and all(x.find('http') >= 0 for x in conf["minput"].split()):
+            conf["minput"] = conf["minput"].split()         # several urls
+        conf["moutput"] = self.outputFileName_lineEdit.text()
+        conf["mcover_page"] = self.coverPage_lineEdit.text()
+        conf ["mpage_orientation"] = self.orient_comboBox.currentText()
+        conf ["mpage_size"] = self.psize_comboBox.currentText()
+        conf["mfont"] = self.font_comboBox.currentText()
+        conf["mfont_size"] = self.fontSize_spinBox.value()
+        conf["mframe_count"] = self.frame_count_spinBox.value()
+        conf["mpage_margin"] = self.pageMargin_doubleSpinBox.value()
+        conf["mcols"] = self.no_cols_spinBox.value()
+        conf[ "mcol_widths"] = [int(x) for x in self.col_widths_lineEdit.text().split(' ') ]
+        return(conf)
+
+    def schedule_preview(self, *args):
+        self.preview_timer.start()          # restarted by each change, so it waits for the last
+
+    def start_preview(self):
+        try:
+            conf = self.read_gui(dict(self.conf))
+        except ValueError:                  # column widths being typed
+            return
+        if self.preview.isRunning():
+            self.preview_pending = True
+            return
+        self.preview.conf = conf
+        self.preview.start()
+
+    def show_preview(self, pdf):
+        if self.preview_pending:
+            self.preview_pending = False
+            self.start_preview()
+        if not pdf:
+            self.preview_label.setText("No preview, see events2pdf.log")
+            return
+
+        from PyQt6.QtPdf import QPdfDocument
+        buf = QtCore.QBuffer()
+        buf.setData(pdf)
+        buf.open(QtCore.QIODevice.OpenModeFlag.ReadOnly)
+        doc = QPdfDocument(self)
+        doc.load(buf)
+        images = []
+        for i in range(min(PREVIEW_PAGES, doc.pageCount())):
+            size = doc.pagePointSize(i)
+            images.append(doc.render(i, QtCore.QSize(PREVIEW_WIDTH, int(PREVIEW_WIDTH * size.height() / size.width()))))
+        doc.close()
+
+        pixmap = QtGui.QPixmap(PREVIEW_WIDTH, sum(x.height() + 4 for x in images))
+        pixmap.fill(QtGui.QColor("gray"))
+        painter = QtGui.QPainter(pixmap)
+        y = 0
+        for image in images:
+            painter.drawImage(0, y, image)
+            y += image.height() + 4
+        painter.end()
+        self.preview_label.setPixmap(pixmap)
+
     def reset_conf(self):
         try:
             self.conf = json.load(open(DEFAULT_CONFIG_FILE))
@@ -43,17 +197,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.load_gui()
         
     def save_conf(self):
-        self.conf["minput"] = self.source_lineEdit.text()
-        self.conf["moutput"] = self.outputFileName_lineEdit.text()
-        self.conf["mcover_page"] = self.coverPage_lineEdit.text()
-        self.conf ["mpage_orientation"] = self.orient_comboBox.currentText()
-        self.conf ["mpage_size"] = self.psize_comboBox.currentText()
-        self.conf["mfont"] = self.font_comboBox.currentText()
-        self.conf["mfont_size"] = self.fontSize_spinBox.value()
-        self.conf["mframe_count"] = self.frame_count_spinBox.value()
-        self.conf["mpage_margin"] = self.pageMargin_doubleSpinBox.value()
-        self.conf["mcols"] = self.no_cols_spinBox.value()
-        self.conf[ "mcol_widths"] = [int(x) for x in self.col_widths_lineEdit.text().split(' ') ]
+        self.read_gui(self.conf)
         
         try:
             json.dump(self.conf, open(CONFIG_FILE, "w"), indent=4)
@@ -61,19 +205,49 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
              self.showMessage(f"cannot save config file {CONFIG_FILE}: {err}")
             
     def create_pdf(self):
-        self.conf["minput"] = self.source_lineEdit.text()
-        self.conf["moutput"] = self.outputFileName_lineEdit.text()
-        self.conf["mcover_page"] = self.coverPage_lineEdit.text()
-        self.conf ["mpage_orientation"] = self.orient_comboBox.currentText()
-        self.conf ["mpage_size"] = self.psize_comboBox.currentText()
-        self.conf["mfont"] = self.font_comboBox.currentText()
-        self.conf["mfont_size"] = self.fontSize_spinBox.value()
-        self.conf["mframe_count"] = self.frame_count_spinBox.value()
-        self.conf["mpage_margin"] = self.pageMargin_doubleSpinBox.value()
-        self.conf["mcols"] = self.no_cols_spinBox.value()
-        self.conf[ "mcol_widths"] = [int(x) for x in self.col_widths_lineEdit.text().split(' ') ]
-        events2pdf_sub(self.conf)
-        self.showMessage(f'{self.conf["moutput"]} created')
+        self.read_gui(self.conf)
+
+        self.pending = dict(self.conf)
+        if self.worker is None:
+            self.start_worker()
+        else:               # the new settings start when the running pdf stops
+            self.worker.cancel.set()
+            self.statusBar().showMessage("Cancelling, then starting again")
+
+    def start_worker(self):
+        self.worker = PdfWorker(self.pending, self)
+        self.pending = None
+        self.worker.progress.connect(self.statusBar().showMessage)
+        self.worker.done.connect(self.worker_done)
+        self.progressBar.show()
+        self.cancel_pushButton.show()
+        self.worker.start()
+
+    def cancel_pdf(self):
+        self.pending = None
+        if self.worker is not None:
+            self.worker.cancel.set()
+            self.statusBar().showMessage("Cancelling")
+
+    def worker_done(self, text):
+        self.worker.wait()
+        self.worker = None
+        if self.pending is not None:
+            self.start_worker()
+            return
+        self.progressBar.hide()
+        self.cancel_pushButton.hide()
+        self.statusBar().showMessage(text or "Cancelled", 5000)
+        if text:
+            self.showMessage(text)
+
+    def closeEvent(self, event):
+        self.cancel_pdf()
+        if self.worker is not None:
+            self.worker.wait()
+        self.preview_timer.stop()
+        self.preview.wait()
+        event.accept()
 
         
     def __init__(self, *args, obj=None, **kwargs):
@@ -88,10 +262,46 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         for x in self.conf["mfonts"]:
             self.font_comboBox.addItem(x)
         self.load_gui()        
+
+        self.worker, self.pending = None, None
+        self.progressBar = QProgressBar()
+        self.progressBar.setRange(0, 0)         # busy, the page count isn't known ahead
+        self.progressBar.setMaximumWidth(120)
+        self.cancel_pushButton = QPushButton("Cancel")
+        self.cancel_pushButton.pressed.connect(self.cancel_pdf)
+        self.statusBar().addPermanentWidget(self.progressBar)
+        self.statusBar().addPermanentWidget(self.cancel_pushButton)
+        self.progressBar.hide()
+        self.cancel_pushButton.hide()
+
+        self.preview = PreviewWorker(self)
+        self.preview.done.connect(self.show_preview)
+        self.preview_pending = False
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY)
+        self.preview_timer.timeout.connect(self.start_preview)
+        self.preview_label = QLabel("Preview")
+        self.preview_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignTop)
+        scroll = QScrollArea()
+        scroll.setWidget(self.preview_label)
+        scroll.setWidgetResizable(True)
+        dock = QDockWidget("Preview", self)
+        dock.setWidget(scroll)
+        self.addDockWidget(QtCore.Qt.DockWidgetArea.RightDockWidgetArea, dock)
+        for w in [self.orient_comboBox, self.psize_comboBox, self.font_comboBox]:
+            w.currentTextChanged.connect(self.schedule_preview)
+        for w in [self.fontSize_spinBox, self.frame_count_spinBox, self.pageMargin_doubleSpinBox, self.no_cols_spinBox]:
+            w.valueChanged.connect(self.schedule_preview)
+        for w in [self.source_lineEdit, self.coverPage_lineEdit, self.col_widths_lineEdit]:
+            w.editingFinished.connect(self.schedule_preview)
+        self.schedule_preview()
+
         self.save_pushButton.pressed.connect(self.save_conf)
         self.create_pushButton.pressed.connect(self.create_pdf)
         self.reset_pushButton.pressed.connect(self.reset_conf)
 
+setup_logging()         # before ErrorLog joins the root logger
 app = QtWidgets.QApplication(sys.argv)
 window = MainWindow()
 window.show()